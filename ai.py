@@ -1,294 +1,363 @@
+import os
 import random
-from helper import board, connections, mills, count_pieces
+import threading
+import time
+from helper import board, PLAYERS, SIDE, MILLS_BY_SQUARE, SQUARE_WEIGHTS, NO_CAPTURE_PLIES
+from movegen import slides, forms_mill
+from search import Search, MAX_PLY
+from tablebase import Tablebase
+from book import OpeningBook
+from instrument import new_record, finish_record, add_search_stats
+from evaluate import WEIGHTS, load_weights
+from ttable import EXACT
+from cache import SearchCache, fingerprint
+
+# Difficulty levels as search budgets. nodes bounds every decision
+# (None: the time_limit given to MorrisAI does), max_depth the
+# iterative deepening, and noise is the most evaluation points added
+# to or taken off any position. A node budget is what levels 1-4
+# guarantee: their time per move is at most nodes divided by the
+# machine's search speed (nodes_per_second in bench.py's report).
+PROFILES = {
+    1: {'nodes': 300, 'max_depth': 1, 'noise': 300},
+    2: {'nodes': 500, 'max_depth': 2, 'noise': 40},
+    3: {'nodes': 2000, 'max_depth': 3, 'noise': 15},
+    4: {'nodes': 10000, 'max_depth': 6, 'noise': 5},
+    5: {'nodes': None, 'max_depth': MAX_PLY, 'noise': 0},
+}
 
 class MorrisAI:
-    def __init__(self, difficulty=1):
+    def __init__(self, difficulty=1, position=None, player='2', time_limit=1.0,
+                 tt_size_mb=16, tablebase_dir=None, book_path=None, workers=1,
+                 weights=None, engine='alphabeta', cache=None, seed=None, profile=None,
+                 draw_plies=NO_CAPTURE_PLIES):
+        if difficulty not in PROFILES:
+            raise ValueError(f'difficulty must be one of {sorted(PROFILES)}')
         self.difficulty = difficulty
-        self.player = '2'
-        self.opponent = '1'
+        # The level's budgets, with any entries of profile instead
+        self.profile = dict(PROFILES[difficulty], **(profile or {}))
+        # Every random choice comes from here: with a seed and a node
+        # budget the AI plays the same moves every time
+        self.rng = random.Random(seed)
+        salt = self.rng.getrandbits(64)
+        self.position = board if position is None else position
+        self.player = player
+        self.side = SIDE[player]
+        self.opponent = PLAYERS[self.side ^ 1]
+        self.time_limit = time_limit
+        # Search evaluation weights: a dict, a tune.py file, or by
+        # default evaluate.WEIGHTS_FILE when it exists
+        if not isinstance(weights, dict):
+            weights = load_weights(weights)
+        self.weights = weights
+        weights = None if weights is WEIGHTS else weights
+        # Plies without a capture that draw the game, as in
+        # Game(no_capture_plies=...); None turns the rule off
+        self.draw_plies = float('inf') if draw_plies is None else draw_plies
+        if engine == 'mcts':
+            # Monte Carlo tree search at difficulty 5 instead of alpha-beta;
+            # node budgets are counted in alpha-beta nodes, and a playout
+            # costs far more than one
+            if self.profile['nodes'] is not None:
+                raise ValueError("engine='mcts' needs a time budget (difficulty 5)")
+            from mcts import MCTS
+            self.search = MCTS(seed=salt, weights=weights, draw_plies=self.draw_plies)
+        elif engine != 'alphabeta':
+            raise ValueError(f'unknown engine {engine!r}')
+        elif workers > 1 and self.profile['nodes'] is None:
+            # Parallel search; search.report holds per-worker statistics
+            from parallel import ParallelSearch
+            self.search = ParallelSearch(workers, tt_size_mb, tablebase_dir, weights,
+                                         self.draw_plies)
+        else:
+            tablebase = None if tablebase_dir is None else Tablebase(tablebase_dir)
+            self.search = Search(tt_size_mb, tablebase, weights=weights,
+                                 noise=self.profile['noise'], salt=salt)
+            self.search.draw_plies = self.draw_plies
+        self.book = None if book_path is None else OpeningBook(book_path)
+        # Alpha-beta search for analyse when self.search is another kind
+        self.analysis_search = None
+        # Results of earlier searches: a SearchCache (possibly shared by
+        # several AIs) or a file loaded now and written by save_cache
+        self.cache_path = None
+        if isinstance(cache, str):
+            self.cache_path = cache
+            settings = fingerprint({
+                'engine': engine, 'weights': self.weights, 'draw_plies': self.draw_plies,
+                'tablebase_pieces': 0 if tablebase_dir is None
+                                    else Tablebase(tablebase_dir).max_pieces})
+            cache = SearchCache(fingerprint=settings)
+            if os.path.exists(self.cache_path):
+                try:
+                    cache.load(self.cache_path)
+                except ValueError:
+                    # Damaged, outdated or from other settings; start over
+                    cache = SearchCache(fingerprint=settings)
+        self.cache = cache
+        # Score and depth of the last search or cache answer; a book
+        # move leaves last_score None
+        self.last_score = None
+        self.last_depth = 0
+        self.planned_removal = None
+        # Callbacks receiving per-decision statistics (see instrument.py)
+        self.hooks = []
+        self.decision = None
+        # Background search during the opponent's turn (see ponder)
+        self.ponder_thread = None
+        self.ponder_root = None
+        self.ponder_result = None
+        self.ponder_hit = False
     
-    def get_valid_positions(self):
-        """Get all empty positions on the board"""
-        return [i for i in range(24) if board[i] == ' ']
+    def ponder(self):
+        """Search the opponent's turn in the background until the AI
+        moves or stop_pondering is called.
+
+        The results stay in the transposition table, so when the
+        opponent plays a move the search looked at, the AI's own search
+        starts from the depth already reached. Only profiles with a time
+        budget (difficulty 5) and a single search process ponder.
+        """
+        if self.profile['nodes'] is not None or not isinstance(self.search, Search):
+            return
+        if self.ponder_thread is not None:
+            return
+        root = self.position.copy()
+        root.turn = self.side ^ 1
+        if self.search.stop is None:
+            self.search.stop = threading.Event()
+        self.search.stop.clear()
+        self.ponder_root = root
+        self.ponder_result = None
+        self.ponder_thread = threading.Thread(target=self.run_ponder, args=(root,), daemon=True)
+        self.ponder_thread.start()
     
-    def get_player_pieces(self, player):
-        """Get all positions where player has pieces"""
-        return [i for i in range(24) if board[i] == player]
+    def run_ponder(self, root):
+        self.ponder_result = self.search.run(root, max_depth=MAX_PLY)
     
-    def get_valid_moves(self, player):
-        """Get all valid moves for a player"""
-        pieces = self.get_player_pieces(player)
-        moves = []
-        
-        for piece in pieces:
-            for adjacent in connections[piece]:
-                if board[adjacent] == ' ':
-                    moves.append((piece, adjacent))
-        return moves
+    def stop_pondering(self):
+        """Stop a background search and wait for it to finish"""
+        if self.ponder_thread is None:
+            return
+        self.search.stop.set()
+        self.ponder_thread.join()
+        self.search.stop.clear()
+        self.ponder_thread = None
     
-    def get_valid_flights(self, player):
-        """Get all valid flights for a player (can move to any empty position)"""
-        pieces = self.get_player_pieces(player)
-        empty = self.get_valid_positions()
-        moves = []
-        
-        for piece in pieces:
-            for empty_pos in empty:
-                moves.append((piece, empty_pos))
-        return moves
+    def predicted_key(self):
+        """Key of the position after the opponent's expected reply"""
+        if self.ponder_result is None or self.ponder_result[0] is None:
+            return None
+        position = self.ponder_root.copy()
+        position.make(self.ponder_result[0])
+        position.turn = self.side
+        return position.key
     
-    def check_potential_mill(self, pos, player):
-        """Check if placing/moving to position would form a mill"""
-        temp_board = board[:]
-        temp_board[pos] = player
-        
-        # Check all mill patterns for this position
-        for mill in mills:
-            if pos in mill:
-                if all(temp_board[p] == player for p in mill):
-                    return True
-        return False
+    def add_hook(self, hook):
+        """Call hook(record) after every decision from now on"""
+        self.hooks.append(hook)
+        self.search.timing = True
     
-    def check_block_mill(self, pos):
-        """Check if placing here would block opponent's mill"""
-        # Try placing opponent piece to see if it forms mill
-        temp_board = board[:]
-        temp_board[pos] = self.opponent
-        
-        for mill in mills:
-            if pos in mill:
-                if all(temp_board[p] == self.opponent for p in mill):
-                    return True
-        return False
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+        self.search.timing = bool(self.hooks)
+    
+    def begin_decision(self, call, phase):
+        """Start a record unless one is already open; True if started"""
+        if self.decision is not None:
+            return False
+        self.decision = new_record(self, call, phase)
+        return True
+    
+    def end_decision(self):
+        record = finish_record(self.decision)
+        self.decision = None
+        for hook in self.hooks:
+            hook(record)
+    
+    def close(self):
+        """Release worker processes held by a parallel search"""
+        self.stop_pondering()
+        self.save_cache()
+        if hasattr(self.search, 'close'):
+            self.search.close()
+    
+    def save_cache(self):
+        """Write the search cache to the file it was loaded from"""
+        if self.cache is not None and self.cache_path is not None:
+            self.cache.save(self.cache_path)
+    
+    def get_valid_moves(self, player):
+        """Get all valid moves for a player"""
+        return slides(self.position, SIDE[player])
     
     def evaluate_position(self, pos):
         """Evaluate how good a position is (higher = better)"""
-        score = 0
-        
-        # Center positions are generally better
-        center_positions = [9, 10, 11, 12, 13, 14, 15, 16]
-        if pos in center_positions:
-            score += 2
-        
-        # Corner positions can be strategic
-        corner_positions = [0, 2, 6, 8, 16, 18, 22, 23]
-        if pos in corner_positions:
-            score += 1
+        # Center and corner bonuses come precomputed per point
+        score = SQUARE_WEIGHTS[pos]
         
         # Count potential mills through this position
-        mill_potential = 0
-        for mill in mills:
-            if pos in mill:
-                empty_count = sum(1 for p in mill if board[p] == ' ')
-                ai_count = sum(1 for p in mill if board[p] == self.player)
-                if empty_count > 0 and ai_count > 0:
-                    mill_potential += 1
-        
-        score += mill_potential
+        empty = self.position.empty
+        own = self.position.bits[self.side]
+        for mask in MILLS_BY_SQUARE[pos]:
+            if mask & empty and mask & own:
+                score += 1
         return score
     
-    def minimax_evaluate_board(self):
-        """Simple board evaluation for minimax"""
-        ai_pieces = count_pieces(self.player)
-        opponent_pieces = count_pieces(self.opponent)
-        
-        # Basic evaluation: piece advantage
-        score = (ai_pieces - opponent_pieces) * 10
-        
-        # Add bonus for mills and potential mills
-        ai_positions = self.get_player_pieces(self.player)
-        for pos in ai_positions:
-            score += self.evaluate_position(pos)
-        
-        return score
+    def make_move(self, phase, pieces_left=0, time_limit=None):
+        """Make AI move based on difficulty and phase
+
+        time_limit (seconds) bounds the search of profiles without a
+        node budget (difficulty 5) and defaults to the limit given to
+        the constructor.
+        """
+        if not self.hooks:
+            return self.pick_move(phase, time_limit)
+        opened = self.begin_decision('make_move', phase)
+        started = time.perf_counter()
+        result = self.pick_move(phase, time_limit)
+        self.decision['move_seconds'] = time.perf_counter() - started
+        self.decision['move'] = result
+        if opened:
+            self.end_decision()
+        return result
     
-    def make_move(self, phase, pieces_left=0):
-        """Make AI move based on difficulty and phase"""
-        if phase == 'placing':
-            return self.make_placing_move()
-        elif phase == 'moving':
-            return self.make_moving_move()
-        elif phase == 'flying':
-            return self.make_flying_move()
+    def pick_move(self, phase, time_limit=None):
+        # Level 4+: answer book positions without searching
+        if self.book is not None and phase == 'placing' and self.difficulty >= 4:
+            move = self.book.lookup(self.root_position())
+            if move is not None:
+                self.last_score = None
+                if self.decision is not None:
+                    self.decision['source'] = 'book'
+                return self.play_move(move, phase)
+        return self.make_search_move(phase, time_limit)
     
-    def make_placing_move(self):
-        """AI logic for placing phase"""
-        valid_positions = self.get_valid_positions()
-        
-        if self.difficulty == 1:
-            # Level 1: Random placement
-            return random.choice(valid_positions)
-        
-        elif self.difficulty == 2:
-            # Level 2: Try to form mills, block opponent
-            # First priority: complete a mill
-            for pos in valid_positions:
-                if self.check_potential_mill(pos, self.player):
-                    return pos
-            
-            # Second priority: block opponent mill
-            for pos in valid_positions:
-                if self.check_block_mill(pos):
-                    return pos
-            
-            # Otherwise random
-            return random.choice(valid_positions)
-        
-        elif self.difficulty >= 3:
-            # Level 3+: Strategic placement with position evaluation
-            best_pos = None
-            best_score = -1000
-            
-            for pos in valid_positions:
-                score = 0
-                
-                # Highest priority: form mill
-                if self.check_potential_mill(pos, self.player):
-                    score += 100
-                
-                # High priority: block opponent mill
-                if self.check_block_mill(pos):
-                    score += 50
-                
-                # Medium priority: position value
-                score += self.evaluate_position(pos) * 5
-                
-                # Level 4+: Look ahead
-                if self.difficulty >= 4:
-                    # Simulate placing here and evaluate resulting position
-                    board[pos] = self.player
-                    score += self.minimax_evaluate_board()
-                    board[pos] = ' '
-                
-                if score > best_score:
-                    best_score = score
-                    best_pos = pos
-            
-            return best_pos or random.choice(valid_positions)
+    def choose_move(self, time_limit=None):
+        """Complete (src, dst, cap) move for the AI in the current position,
+        for callers that apply whole moves (headless games, servers)"""
+        position = self.position
+        phase = position.phase(self.side)
+        opened = self.hooks and self.begin_decision('choose_move', phase)
+        move = None
+        step = self.make_move(phase, position.in_hand[self.side], time_limit)
+        if step is not None:
+            src, dst = (None, step) if phase == 'placing' else step
+            move = (src, dst, None)
+            if forms_mill(position, self.side, src, dst):
+                # Pick the capture on the board as it stands after the move
+                if src is not None:
+                    position.remove(src, self.side)
+                position.put(dst, self.side)
+                move = (src, dst, self.choose_piece_to_remove())
+                position.remove(dst, self.side)
+                if src is not None:
+                    position.put(src, self.side)
+        if opened:
+            self.decision['move'] = move
+            self.end_decision()
+        return move
     
-    def make_moving_move(self):
-        """AI logic for moving phase"""
-        valid_moves = self.get_valid_moves(self.player)
-        
-        if not valid_moves:
-            return None
-        
-        if self.difficulty == 1:
-            # Level 1: Random move
-            return random.choice(valid_moves)
+    def make_search_move(self, phase, time_limit=None):
+        """Search within the profile's node or time budget"""
+        if time_limit is None:
+            time_limit = self.time_limit
+        self.stop_pondering()
+        root = self.root_position()
+        self.ponder_hit = self.ponder_root is not None and self.predicted_key() == root.key
+        self.ponder_root = self.ponder_result = None
         
-        elif self.difficulty == 2:
-            # Level 2: Try to form mills, block opponent
-            for from_pos, to_pos in valid_moves:
-                if self.check_potential_mill(to_pos, self.player):
-                    return (from_pos, to_pos)
-            
-            # Try to block opponent
-            for from_pos, to_pos in valid_moves:
-                if self.check_block_mill(to_pos):
-                    return (from_pos, to_pos)
-            
-            return random.choice(valid_moves)
+        # A cached search at least as deep as our last one answers at
+        # once; a shallower one lets the search start past its depth.
+        # Noisy searches neither use nor fill the cache.
+        use_cache = (self.cache is not None and hasattr(self.search, 'tt')
+                     and not self.profile['noise'])
+        cached = self.cache.lookup(root) if use_cache else None
+        if cached is not None:
+            move, score, depth = cached
+            if depth >= self.last_depth:
+                self.last_score, self.last_depth = score, depth
+                if self.decision is not None:
+                    self.decision.update(source='cache', score=score, depth=depth)
+                return self.play_move(move, phase)
+            self.search.tt.store(root.key, depth, EXACT, score, move)
         
-        elif self.difficulty >= 3:
-            # Level 3+: Strategic moving
-            best_move = None
-            best_score = -1000
-            
-            for from_pos, to_pos in valid_moves:
-                score = 0
-                
-                # Simulate move
-                board[from_pos] = ' '
-                board[to_pos] = self.player
-                
-                # Check if this forms a mill
-                if self.check_potential_mill(to_pos, self.player):
-                    score += 100
-                
-                # Check if this blocks opponent mill
-                board[to_pos] = ' '
-                if self.check_block_mill(to_pos):
-                    score += 50
-                board[to_pos] = self.player
-                
-                # Position evaluation
-                score += self.evaluate_position(to_pos) * 3
-                score -= self.evaluate_position(from_pos) * 2
-                
-                # Level 4+: Board evaluation
-                if self.difficulty >= 4:
-                    score += self.minimax_evaluate_board()
-                
-                # Level 5: More sophisticated evaluation
-                if self.difficulty == 5:
-                    # Consider opponent's responses
-                    opponent_moves = self.get_valid_moves(self.opponent)
-                    threat_score = 0
-                    for opp_from, opp_to in opponent_moves[:5]:  # Check first 5 moves
-                        board[opp_from] = ' '
-                        board[opp_to] = self.opponent
-                        if self.check_potential_mill(opp_to, self.opponent):
-                            threat_score -= 30
-                        board[opp_from] = self.opponent
-                        board[opp_to] = ' '
-                    score += threat_score
-                
-                # Restore board
-                board[to_pos] = ' '
-                board[from_pos] = self.player
-                
-                if score > best_score:
-                    best_score = score
-                    best_move = (from_pos, to_pos)
-            
-            return best_move or random.choice(valid_moves)
+        nodes = self.profile['nodes']
+        move, score, depth = self.search.run(root, self.profile['max_depth'],
+                                             None if nodes else time_limit, nodes)
+        self.last_score, self.last_depth = score, depth
+        if use_cache:
+            self.cache.store(root, move, score, depth)
+        if self.decision is not None:
+            add_search_stats(self.decision, self.search, score, depth)
+            self.decision['ponder_hit'] = self.ponder_hit
+        return self.play_move(move, phase)
     
-    def make_flying_move(self):
-        """AI logic for flying phase"""
-        valid_moves = self.get_valid_flights(self.player)
-        
-        if not valid_moves:
+    def analyse(self, count=3, time_limit=None, max_depth=MAX_PLY):
+        """Rank the best count moves for the side to move in
+        self.position in one search, at any difficulty. Returns dicts
+        with the (src, dst, cap) move, its score for the side to move,
+        the principal variation and the depth reached, best first."""
+        if time_limit is None:
+            time_limit = self.time_limit
+        self.stop_pondering()
+        search = self.search
+        if not isinstance(search, Search) or self.profile['noise']:
+            # MCTS and the parallel search only pick one move, and
+            # hints should not carry the level's noise
+            if self.analysis_search is None:
+                self.analysis_search = Search(
+                    weights=None if self.weights is WEIGHTS else self.weights)
+                self.analysis_search.draw_plies = self.draw_plies
+            search = self.analysis_search
+        position = self.position
+        _, _, depth = search.run(position, max_depth, time_limit, count=count)
+        return [{'move': move, 'score': score, 'depth': depth,
+                 'pv': search.principal_variation(position, move, depth)}
+                for move, score in search.lines]
+    
+    def root_position(self):
+        """Copy of the position with the AI to move"""
+        position = self.position.copy()
+        position.turn = self.side
+        return position
+    
+    def play_move(self, move, phase):
+        """Turn a (src, dst, cap) move into make_move's return value"""
+        if move is None:
             return None
-        
-        if self.difficulty == 1:
-            return random.choice(valid_moves)
-        
-        # For all levels 2+, prioritize forming mills in flying phase
-        best_move = None
-        best_score = -1000
-        
-        for from_pos, to_pos in valid_moves:
-            score = 0
-            
-            # Simulate move
-            board[from_pos] = ' '
-            board[to_pos] = self.player
-            
-            if self.check_potential_mill(to_pos, self.player):
-                score += 100
-            
-            score += self.evaluate_position(to_pos) * 2
-            
-            if self.difficulty >= 4:
-                score += self.minimax_evaluate_board()
-            
-            # Restore board
-            board[to_pos] = ' '
-            board[from_pos] = self.player
-            
-            if score > best_score:
-                best_score = score
-                best_move = (from_pos, to_pos)
-        
-        return best_move or random.choice(valid_moves)
+        src, dst, cap = move
+        # The capture was chosen together with the move
+        self.planned_removal = cap
+        if phase == 'placing':
+            return dst
+        return (src, dst)
     
     def choose_piece_to_remove(self):
         """Choose which opponent piece to remove when mill is formed"""
-        opponent_pieces = self.get_player_pieces(self.opponent)
+        if not self.hooks:
+            return self.pick_removal()
+        opened = self.begin_decision('choose_piece_to_remove',
+                                     self.position.phase(self.side))
+        started = time.perf_counter()
+        piece = self.pick_removal()
+        self.decision['capture_seconds'] = time.perf_counter() - started
+        self.decision['capture'] = piece
+        if opened:
+            self.end_decision()
+        return piece
+    
+    def pick_removal(self):
+        # Pieces in mills are protected unless every piece is in one
+        opponent_pieces = self.position.removable(self.side ^ 1)
+        
+        planned, self.planned_removal = self.planned_removal, None
+        if planned in opponent_pieces:
+            return planned
+        if not opponent_pieces:
+            return None
         
         if self.difficulty == 1:
-            return random.choice(opponent_pieces)
+            return self.rng.choice(opponent_pieces)
         
         # For higher difficulties, prioritize removing pieces that:
         # 1. Are part of opponent mills
@@ -298,17 +367,16 @@ class MorrisAI:
         best_target = None
         best_score = -1000
         
+        other = self.side ^ 1
+        theirs = self.position.bits[other]
         for piece in opponent_pieces:
             score = 0
             
             # Check if removing this breaks opponent mill
-            board[piece] = ' '
             mills_broken = 0
-            for mill in mills:
-                if piece in mill:
-                    if all(board[p] == self.opponent for p in mill if p != piece):
-                        mills_broken += 1
-            board[piece] = self.opponent
+            for mask in MILLS_BY_SQUARE[piece]:
+                if theirs & mask == mask:
+                    mills_broken += 1
             score += mills_broken * 50
             
             # Prefer removing pieces from good positions
@@ -317,9 +385,9 @@ class MorrisAI:
             # Level 4+: Consider mobility impact
             if self.difficulty >= 4:
                 # Count how many moves opponent loses by removing this piece
-                board[piece] = ' '
+                self.position.remove(piece, other)
                 moves_before = len(self.get_valid_moves(self.opponent))
-                board[piece] = self.opponent
+                self.position.put(piece, other)
                 moves_after = len(self.get_valid_moves(self.opponent))
                 score += (moves_after - moves_before) * 2
             
@@ -327,4 +395,4 @@ class MorrisAI:
                 best_score = score
                 best_target = piece
         
-        return best_target or random.choice(opponent_pieces)
\ No newline at end of file
+        return best_target
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""Vectorized evaluation of many positions at once (requires NumPy).
+
+Boards are (N, 24) int8 arrays holding 0 for an empty point, 1 for a
+piece of player '1' and 2 for a piece of player '2'. The terms and
+weights are those of evaluate.py, so batch_evaluate agrees with
+evaluate() position for position.
+"""
+import numpy as np
+from helper import connections, mills, SIDE, PLAYERS
+from evaluate import WEIGHTS
+
+# MILL_MATRIX[p, m] is 1 when point p lies on mill m
+MILL_MATRIX = np.zeros((24, len(mills)), dtype=np.int16)
+for _m, _mill in enumerate(mills):
+    MILL_MATRIX[_mill, _m] = 1
+
+# ADJACENCY[p, q] is 1 when p and q are connected
+ADJACENCY = np.zeros((24, 24), dtype=np.int16)
+for _p, _neighbours in connections.items():
+    ADJACENCY[_p, _neighbours] = 1
+
+FEATURES = ('material', 'mills', 'open_twos', 'mobility', 'blocked')
+
+def positions_to_array(positions):
+    """Boards, pieces in hand and side to move of Position objects as
+    arrays of shape (N, 24), (N, 2) and (N,)"""
+    boards = np.zeros((len(positions), 24), dtype=np.int8)
+    in_hand = np.zeros((len(positions), 2), dtype=np.int16)
+    turn = np.zeros(len(positions), dtype=np.int8)
+    for row, position in enumerate(positions):
+        for i, cell in enumerate(position):
+            if cell != ' ':
+                boards[row, i] = SIDE[cell] + 1
+        in_hand[row] = position.in_hand
+        turn[row] = position.turn
+    return boards, in_hand, turn
+
+def batch_features(boards, in_hand=None):
+    """Evaluation terms for both players: a dict of (N, 2) arrays"""
+    boards = np.asarray(boards)
+    empty = (boards == 0).astype(np.int16)
+    empty_in_mill = empty @ MILL_MATRIX
+    empty_neighbours = empty @ ADJACENCY
+
+    result = {name: np.zeros((len(boards), 2), dtype=np.int32) for name in FEATURES}
+    for side in range(len(PLAYERS)):
+        own = (boards == side + 1).astype(np.int16)
+        own_in_mill = own @ MILL_MATRIX
+        result['material'][:, side] = own.sum(axis=1)
+        result['mills'][:, side] = (own_in_mill == 3).sum(axis=1)
+        result['open_twos'][:, side] = ((own_in_mill == 2) & (empty_in_mill > 0)).sum(axis=1)
+        result['mobility'][:, side] = (own * empty_neighbours).sum(axis=1)
+        result['blocked'][:, side] = (own * (empty_neighbours == 0)).sum(axis=1)
+    if in_hand is not None:
+        result['material'] += np.asarray(in_hand, dtype=np.int32)
+    return result
+
+def batch_evaluate(boards, in_hand=None, turn=0, weights=None, chunk_size=65536):
+    """Scores of N boards, each from the point of view of its side to
+    move (turn, a scalar or an (N,) array of 0/1)"""
+    if weights is None:
+        weights = WEIGHTS
+    boards = np.asarray(boards)
+    turn = np.broadcast_to(np.asarray(turn), (len(boards),))
+    scores = np.empty(len(boards), dtype=np.int64)
+    # Work in chunks so intermediate arrays stay small for huge inputs
+    for start in range(0, len(boards), chunk_size):
+        stop = start + chunk_size
+        hand = None if in_hand is None else np.asarray(in_hand)[start:stop]
+        features = batch_features(boards[start:stop], hand)
+        diff = sum(weights[name] * (features[name][:, 0] - features[name][:, 1])
+                   for name in FEATURES)
+        scores[start:stop] = np.where(turn[start:stop] == 0, diff, -diff)
+    return scores
+
+def check_against_reference(positions):
+    """Number of positions where batch_evaluate and evaluate() disagree"""
+    from evaluate import evaluate
+    boards, in_hand, turn = positions_to_array(positions)
+    batch = batch_evaluate(boards, in_hand, turn)
+    return sum(1 for position, score in zip(positions, batch)
+               if evaluate(position) != score)
@@ -0,0 +1,213 @@
+"""Engine benchmarks on a fixed corpus of positions.
+
+    python bench.py --out bench.json               # run and save
+    python bench.py --compare baseline.json        # run and compare
+    python bench.py --compare old.json new.json    # compare two saved runs
+
+Three parts: perft node counts, which must match the recorded values
+exactly; nodes/s and time-to-depth for the search and decision time
+for every difficulty level; and latency percentiles for
+MorrisAI.make_move and choose_piece_to_remove. Compare mode exits with
+status 1 when a perft count differs or a speed figure regresses by
+more than the threshold.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from helper import Position
+from movegen import legal_moves, forms_mill
+from search import Search
+from ai import MorrisAI
+
+FORMAT_VERSION = 1
+
+# name, position, perft depth, expected perft count
+CORPUS = [
+    ('start', '........................ 9 9 1', 4, 255024),
+    ('placing_mid', '.1.......2221.2.1..2...1 4 4 1', 4, 42402),
+    ('placing_capture', '.1.......2.21.2.1..21..1 4 5 2', 4, 70098),
+    ('moving_mid', '21..22.1.122.2....212121 0 0 1', 5, 48722),
+    ('moving_capture', '.1.222...2221.2111.2.1.1 0 0 2', 5, 86183),
+    ('flying_vs_moving', '2..222.....1.....1..22.1 0 0 1', 4, 211810),
+    ('moving_vs_flying', '2..222..1........1..22.1 0 0 2', 4, 218873),
+    ('flying_3v3', '....21...2...12.....1... 0 0 2', 3, 159240),
+]
+
+def perft(position, depth):
+    """Number of move sequences of length depth. A game won by taking
+    the opponent below three pieces counts once where it ends; a side
+    with no legal move adds nothing."""
+    if depth == 0 or position.is_lost():
+        return 1
+    total = 0
+    for move in list(legal_moves(position)):
+        position.make(move)
+        total += perft(position, depth - 1)
+        position.unmake()
+    return total
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def pick(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    return {'p50_ms': round(pick(0.5) * 1000, 3), 'p90_ms': round(pick(0.9) * 1000, 3),
+            'p99_ms': round(pick(0.99) * 1000, 3), 'max_ms': round(samples[-1] * 1000, 3)}
+
+def bench_perft():
+    results = {}
+    for name, text, depth, expected in CORPUS:
+        position = Position.from_text(text)
+        started = time.perf_counter()
+        count = perft(position, depth)
+        elapsed = time.perf_counter() - started
+        results[name] = {'depth': depth, 'nodes': count, 'expected': expected,
+                         'ok': count == expected,
+                         'nodes_per_second': round(count / elapsed) if elapsed else 0}
+    return results
+
+def bench_search(max_depth):
+    """Time-to-depth and nodes/s of a fresh search on every position"""
+    results = {}
+    for name, text, _, _ in CORPUS:
+        position = Position.from_text(text)
+        depths = []
+        for depth in range(1, max_depth + 1):
+            search = Search(tt_size_mb=4)
+            started = time.perf_counter()
+            search.run(position, max_depth=depth)
+            elapsed = time.perf_counter() - started
+            depths.append({'depth': depth, 'seconds': round(elapsed, 5), 'nodes': search.nodes})
+        total_nodes = sum(d['nodes'] for d in depths)
+        total_seconds = sum(d['seconds'] for d in depths)
+        results[name] = {'time_to_depth': depths,
+                         'nodes_per_second': round(total_nodes / total_seconds) if total_seconds else 0}
+    return results
+
+def bench_difficulties(repeats, time_limit):
+    """Decision latency of make_move per level, and of
+    choose_piece_to_remove after the moves that close a mill"""
+    results = {}
+    for difficulty in range(1, 6):
+        move_times = []
+        removal_times = []
+        nodes = 0
+        for _ in range(repeats):
+            for name, text, _, _ in CORPUS:
+                position = Position.from_text(text)
+                player = '1' if position.turn == 0 else '2'
+                ai = MorrisAI(difficulty, position=position, player=player,
+                              time_limit=time_limit, tt_size_mb=4, seed=difficulty)
+                side = position.turn
+                phase = position.phase()
+                started = time.perf_counter()
+                step = ai.make_move(phase, position.in_hand[side])
+                move_times.append(time.perf_counter() - started)
+                nodes += ai.search.nodes
+                if step is None:
+                    continue
+                src, dst = (None, step) if phase == 'placing' else step
+                if forms_mill(position, side, src, dst):
+                    # Choose on the board after the move, without the
+                    # capture the search already planned
+                    if src is None:
+                        position.in_hand[side] -= 1
+                    else:
+                        position.remove(src, side)
+                    position.put(dst, side)
+                    ai.planned_removal = None
+                    started = time.perf_counter()
+                    ai.choose_piece_to_remove()
+                    removal_times.append(time.perf_counter() - started)
+        entry = {'make_move': percentiles(move_times),
+                 'choose_piece_to_remove': percentiles(removal_times),
+                 'decisions_per_second': round(len(move_times) / sum(move_times))}
+        if nodes:
+            entry['nodes_per_second'] = round(nodes / sum(move_times))
+        results[str(difficulty)] = entry
+    return results
+
+def run(max_depth=4, repeats=3, time_limit=0.1):
+    return {
+        'version': FORMAT_VERSION,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'perft': bench_perft(),
+        'search': bench_search(max_depth),
+        'difficulty': bench_difficulties(repeats, time_limit),
+    }
+
+def compare(baseline, current, threshold=0.1):
+    """List of problems found in current relative to baseline"""
+    problems = []
+    for name, entry in current['perft'].items():
+        if not entry['ok']:
+            problems.append(f"perft {name}: {entry['nodes']} nodes, expected {entry['expected']}")
+
+    def slower(label, old, new, higher_is_better):
+        if not old or not new:
+            return
+        change = (new - old) / old
+        if (change < -threshold) if higher_is_better else (change > threshold):
+            problems.append(f'{label}: {old} -> {new} ({change:+.0%})')
+
+    for name, entry in current['perft'].items():
+        if name in baseline['perft']:
+            slower(f'perft {name} nodes/s', baseline['perft'][name]['nodes_per_second'],
+                   entry['nodes_per_second'], True)
+    for name, entry in current['search'].items():
+        if name in baseline['search']:
+            slower(f'search {name} nodes/s', baseline['search'][name]['nodes_per_second'],
+                   entry['nodes_per_second'], True)
+    for level, entry in current['difficulty'].items():
+        old = baseline['difficulty'].get(level)
+        if old is None:
+            continue
+        for call in ('make_move', 'choose_piece_to_remove'):
+            for stat in ('p50_ms', 'p90_ms'):
+                slower(f'difficulty {level} {call} {stat}', old[call].get(stat),
+                       entry[call].get(stat), False)
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the engine on a fixed corpus')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help='baseline file, optionally followed by a saved run to compare')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression (default 0.1)')
+    parser.add_argument('--depth', type=int, default=4, help='deepest search to time')
+    parser.add_argument('--repeats', type=int, default=3, help='passes over the corpus per level')
+    parser.add_argument('--time-limit', type=float, default=0.1,
+                        help='search time per move at difficulty 5')
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 1:
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+    else:
+        current = run(args.depth, args.repeats, args.time_limit)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(current, f, indent=2)
+        else:
+            json.dump(current, sys.stdout, indent=2)
+            print()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        problems = compare(baseline, current, args.threshold)
+        for problem in problems:
+            print('REGRESSION', problem)
+        if problems:
+            sys.exit(1)
+        print('no regressions')
+
+if __name__ == '__main__':
+    main()
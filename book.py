@@ -0,0 +1,102 @@
+"""Opening book for the placing phase.
+
+The builder searches every position reachable in the first few
+placements and stores the best reply under the position's canonical
+key (see symmetry.py), so mirror images share one entry:
+
+    python book.py --plies 3 --depth 4 --out book.bin
+
+The file is a header followed by (key, move) entries sorted by key,
+ten bytes each; OpeningBook answers a lookup with one binary search.
+"""
+import argparse
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from helper import Position, encode_move, decode_move
+from movegen import legal_moves, is_legal
+from search import Search
+from symmetry import INVERSE, canonical, transform_move
+
+MAGIC = b'NMMBK'
+VERSION = 2
+HEADER = struct.Struct('<5sBI')
+ENTRY = struct.Struct('<QH')
+
+def build_book(plies=3, depth=4, time_limit=None, verbose=False):
+    """Best move for every position with fewer than plies pieces placed,
+    as a dict from canonical key to move in the canonical orientation"""
+    search = Search()
+    book = {}
+    frontier = [Position()]
+    for ply in range(plies):
+        started = time.perf_counter()
+        children = {}
+        for position in frontier:
+            move, score, reached = search.run(position, max_depth=depth,
+                                              time_limit=time_limit)
+            key, t = canonical(position)
+            book[key] = transform_move(move, t)
+            if ply + 1 < plies:
+                for reply in legal_moves(position):
+                    child = position.copy()
+                    child.make(reply)
+                    # Only one member of each symmetry class is searched
+                    children.setdefault(canonical(child)[0], child)
+        if verbose:
+            print(f'ply {ply}: {len(frontier)} positions in '
+                  f'{time.perf_counter() - started:.1f}s', flush=True)
+        frontier = list(children.values())
+    return book
+
+def write_book(path, book):
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(book)))
+        for key in sorted(book):
+            f.write(ENTRY.pack(key, encode_move(book[key])))
+
+class OpeningBook:
+    """Sorted book entries held in two flat arrays"""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} opening book')
+        self.keys = array('Q')
+        self.moves = array('H')
+        for key, code in ENTRY.iter_unpack(data[HEADER.size:HEADER.size + count * ENTRY.size]):
+            self.keys.append(key)
+            self.moves.append(code)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, position):
+        """Book move for position, or None when it is out of book"""
+        key, t = canonical(position)
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        move = transform_move(decode_move(self.moves[i]), INVERSE[t])
+        # Guard against a stale or foreign book file
+        if not is_legal(position, move):
+            return None
+        return move
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a placing-phase opening book')
+    parser.add_argument('--plies', type=int, default=3, help='placements covered')
+    parser.add_argument('--depth', type=int, default=4, help='search depth per position')
+    parser.add_argument('--time', type=float, default=None,
+                        help='optional time limit per position in seconds')
+    parser.add_argument('--out', default='book.bin', help='output file')
+    args = parser.parse_args()
+
+    book = build_book(args.plies, args.depth, args.time, verbose=True)
+    write_book(args.out, book)
+    print(f'{len(book)} positions written to {args.out}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Results of whole searches, kept across turns, games and processes.
+
+Entries are keyed by symmetry.canonical, so a position is found under
+any of its mirror images, and hold the depth, score and move of the
+deepest search of it. The cache holds at most max_entries positions and
+drops the least recently used first.
+
+The scores depend on the engine's settings, so a cache carries a
+fingerprint of them (see fingerprint) and a file saved under other
+settings is refused like a damaged one.
+
+The file format is HEADER (magic, version, settings fingerprint, entry
+count, CRC-32 of the entries) followed by ENTRY records from least to
+most recently used.
+"""
+import json
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from helper import encode_move, decode_move
+from movegen import is_legal
+from symmetry import canonical, transform_move, INVERSE
+
+MAGIC = b'NMMSC'
+VERSION = 2
+HEADER = struct.Struct('<5sBIII')
+ENTRY = struct.Struct('<QBhH')  # Canonical key, depth, score, move
+
+def fingerprint(settings):
+    """CRC-32 of a JSON-able dict of the settings behind the scores"""
+    return zlib.crc32(json.dumps(settings, sort_keys=True).encode())
+
+class SearchCache:
+    def __init__(self, max_entries=1 << 20, fingerprint=0):
+        self.max_entries = max_entries
+        self.fingerprint = fingerprint
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, position):
+        """(move, score, depth) stored for position, or None"""
+        key, t = canonical(position)
+        entry = self.entries.get(key)
+        if entry is not None:
+            depth, score, code = entry
+            move = transform_move(decode_move(code), INVERSE[t])
+            # A foreign file could hold garbage that passes the CRC
+            if is_legal(position, move):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return move, score, depth
+        self.misses += 1
+        return None
+
+    def store(self, position, move, score, depth):
+        """Remember a finished search unless a deeper one is stored"""
+        if move is None:
+            return
+        key, t = canonical(position)
+        old = self.entries.get(key)
+        if old is None or depth >= old[0]:
+            self.entries[key] = (min(depth, 255), score, encode_move(transform_move(move, t)))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self, path):
+        """Write the cache; the file is replaced only once complete"""
+        payload = b''.join(ENTRY.pack(key, *entry) for key, entry in self.entries.items())
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.fingerprint, len(self.entries),
+                                zlib.crc32(payload)))
+            f.write(payload)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        """Add the entries of a saved cache; raises ValueError for a
+        file of another format, version or fingerprint, or a damaged one"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError(f'{path}: truncated search cache')
+        magic, version, settings, count, crc = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: not a search cache')
+        if version != VERSION:
+            raise ValueError(f'{path}: search cache version {version}, expected {VERSION}')
+        if settings != self.fingerprint:
+            raise ValueError(f'{path}: search cache of other engine settings')
+        payload = data[HEADER.size:]
+        if len(payload) != count * ENTRY.size or zlib.crc32(payload) != crc:
+            raise ValueError(f'{path}: search cache is corrupt')
+        for key, depth, score, code in ENTRY.iter_unpack(payload):
+            self.entries[key] = (depth, score, code)
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
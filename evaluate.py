@@ -0,0 +1,94 @@
+import json
+import os
+from helper import MILL_MASKS, ADJACENT_MASKS, squares
+
+# Score for a won position; wins found sooner score higher
+WIN = 10000
+
+# Weight of each evaluation term
+WEIGHTS = {
+    'material': 10,  # Pieces on the board and in hand
+    'mills': 6,  # Closed mills
+    'open_twos': 4,  # Two pieces and an empty point on one mill
+    'mobility': 1,  # Sliding moves available
+    'blocked': -2,  # Pieces with no empty neighbour
+}
+
+# Weights written by tune.py; used instead of WEIGHTS when present
+WEIGHTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'weights.json')
+
+def load_weights(path=None):
+    """Weights from a tune.py file: path, else WEIGHTS_FILE if it
+    exists, else the built-in WEIGHTS"""
+    if path is None:
+        if not os.path.exists(WEIGHTS_FILE):
+            return WEIGHTS
+        path = WEIGHTS_FILE
+    with open(path) as f:
+        weights = json.load(f)['weights']
+    if set(weights) != set(WEIGHTS):
+        raise ValueError(f'{path}: expected weights for {sorted(WEIGHTS)}')
+    return weights
+
+def features(position, side):
+    """Raw evaluation terms for side, as kept up to date by Position"""
+    return {
+        'material': position.bits[side].bit_count() + position.in_hand[side],
+        'mills': position.closed_mills[side],
+        'open_twos': position.open_twos[side],
+        'mobility': position.mobility[side],
+        'blocked': position.blocked[side],
+    }
+
+def scan_features(position, side):
+    """features() computed from scratch, to check the incremental terms"""
+    own = position.bits[side]
+    empty = position.empty
+
+    mills = 0
+    open_twos = 0
+    for mask in MILL_MASKS:
+        mine = own & mask
+        if mine == mask:
+            mills += 1
+        elif mine.bit_count() == 2 and empty & mask:
+            open_twos += 1
+
+    mobility = 0
+    blocked = 0
+    for sq in squares(own):
+        free = (ADJACENT_MASKS[sq] & empty).bit_count()
+        mobility += free
+        blocked += not free
+
+    return {
+        'material': own.bit_count() + position.in_hand[side],
+        'mills': mills,
+        'open_twos': open_twos,
+        'mobility': mobility,
+        'blocked': blocked,
+    }
+
+def noisy_evaluate(position, salt, spread, w=WEIGHTS):
+    """evaluate plus an offset in -spread..spread hashed from the
+    position and salt, so every line reaching a position sees the
+    same value and the transposition table stays consistent"""
+    noise = ((position.key ^ salt) * 0x9E3779B97F4A7C15 >> 40) % (2 * spread + 1)
+    return evaluate(position, w) + noise - spread
+
+def evaluate(position, w=WEIGHTS):
+    """Static score of position from the side to move's point of view;
+    constant time, since the terms are maintained by put and remove"""
+    bits = position.bits
+    in_hand = position.in_hand
+    mills = position.closed_mills
+    open_twos = position.open_twos
+    mobility = position.mobility
+    blocked = position.blocked
+    score = (w['material'] * (bits[0].bit_count() + in_hand[0]
+                              - bits[1].bit_count() - in_hand[1])
+             + w['mills'] * (mills[0] - mills[1])
+             + w['open_twos'] * (open_twos[0] - open_twos[1])
+             + w['mobility'] * (mobility[0] - mobility[1])
+             + w['blocked'] * (blocked[0] - blocked[1]))
+    return -score if position.turn else score
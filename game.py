@@ -0,0 +1,107 @@
+"""Headless game driver with the rules and win checks of main.play_game"""
+from helper import Position, PLAYERS, NO_CAPTURE_PLIES
+from movegen import legal_moves, is_legal
+from ai import MorrisAI
+
+class Game:
+    """One game between two players, with no prompts or printing.
+
+    A side loses when it has fewer than three pieces once placing is
+    over, or when it cannot move. The game is drawn when a position
+    occurs for the repetitions-th time, after no_capture_plies moves
+    without a capture once placing is over, or after max_plies plies
+    in all; None turns a rule off.
+    """
+    def __init__(self, pieces=9, max_plies=None, repetitions=3,
+                 no_capture_plies=NO_CAPTURE_PLIES):
+        self.position = Position(pieces)
+        self.pieces = pieces
+        self.max_plies = max_plies
+        self.repetitions = repetitions
+        self.no_capture_plies = no_capture_plies
+        self.moves = []
+        self.winner = None
+        self.reason = None
+        self.over = False
+
+    @property
+    def current_player(self):
+        return PLAYERS[self.position.turn]
+
+    @property
+    def phase(self):
+        return self.position.phase()
+
+    def legal_moves(self):
+        return list(legal_moves(self.position))
+
+    def play(self, move):
+        """Apply a (src, dst, cap) move for the side to move"""
+        if self.over:
+            raise ValueError('the game is over')
+        if not is_legal(self.position, move):
+            raise ValueError(f'illegal move {move} for player {self.current_player}')
+        self.position.make(move)
+        self.moves.append(move)
+        self.check_over()
+
+    def check_over(self):
+        position = self.position
+        loser = PLAYERS[position.turn]
+        if position.is_lost():
+            self.finish(PLAYERS[position.turn ^ 1], f'player {loser} has less than 3 pieces')
+        elif not any(True for _ in legal_moves(position)):
+            self.finish(PLAYERS[position.turn ^ 1], f'player {loser} cannot move')
+        elif self.repetitions is not None and position.repetitions() >= self.repetitions:
+            self.finish(None, f'position repeated {self.repetitions} times')
+        elif (self.no_capture_plies is not None
+              and position.quiet_plies >= self.no_capture_plies):
+            self.finish(None, f'{self.no_capture_plies} plies without a capture')
+        elif self.max_plies is not None and len(self.moves) >= self.max_plies:
+            self.finish(None, f'move limit of {self.max_plies} plies reached')
+
+    def finish(self, winner, reason):
+        self.winner = winner
+        self.reason = reason
+        self.over = True
+
+class AIPlayer:
+    """A MorrisAI configuration that can be seated in any Game"""
+    def __init__(self, **options):
+        self.options = options
+        self.engines = {}
+
+    def start(self, game, player):
+        """Take a seat; each game and seat gets a fresh engine, which
+        searches with the game's no-capture limit"""
+        options = dict({'draw_plies': game.no_capture_plies}, **self.options)
+        self.engines[player] = MorrisAI(position=game.position, player=player, **options)
+
+    def choose(self, game):
+        return self.engines[game.current_player].choose_move()
+
+    def close(self):
+        """Release the engines' worker processes and shared memory"""
+        for ai in self.engines.values():
+            ai.close()
+        self.engines = {}
+
+def play_game(first, second, pieces=9, max_plies=None):
+    """Play first (player '1') against second (player '2'); return the Game"""
+    game = Game(pieces, max_plies)
+    players = (first, second)
+    try:
+        for player, seat in zip(PLAYERS, players):
+            seat.start(game, player)
+        while not game.over:
+            move = players[game.position.turn].choose(game)
+            if move is None:
+                game.finish(PLAYERS[game.position.turn ^ 1],
+                            f'player {game.current_player} cannot move')
+                break
+            game.play(move)
+    finally:
+        for seat in players:
+            if hasattr(seat, 'close'):
+                seat.close()
+    return game
@@ -1,4 +1,4 @@
-board = [' '] * 24
+import random
 
 # Define board connections (adjacent positions)
 connections = {
@@ -22,6 +22,319 @@ mills = [
     [8, 12, 17], [5, 13, 20], [2, 14, 23]  # Right connections
 ]
 
+# Players as they appear on the board, indexed by side (0 or 1)
+PLAYERS = ('1', '2')
+SIDE = {'1': 0, '2': 1}
+EMPTY = ' '
+FULL = (1 << 24) - 1
+
+# Plies without a capture (or placement) after which a game is drawn
+NO_CAPTURE_PLIES = 100
+
+# Lookup tables built once from connections and mills, indexed by point
+MILL_MASKS = [sum(1 << p for p in mill) for mill in mills]
+MILLS_BY_SQUARE = tuple(tuple(mask for mask in MILL_MASKS if mask >> i & 1)
+                        for i in range(24))
+NEIGHBOURS = tuple(tuple(connections[i]) for i in range(24))
+ADJACENT_MASKS = tuple(sum(1 << n for n in connections[i]) for i in range(24))
+
+# Static value of each point: +2 for the middle row, +1 for the points
+# the AI treats as corners (16 is both)
+CENTER_POSITIONS = (9, 10, 11, 12, 13, 14, 15, 16)
+CORNER_POSITIONS = (0, 2, 6, 8, 16, 18, 22, 23)
+SQUARE_WEIGHTS = tuple(2 * (i in CENTER_POSITIONS) + (i in CORNER_POSITIONS)
+                       for i in range(24))
+
+# Most pieces per side a position supports
+MAX_PIECES = 12
+
+# Zobrist keys for pieces, pieces in hand and side to move; seeded so
+# hashes are stable across processes and runs
+_zobrist = random.Random(0x9E3779B9)
+ZOBRIST_PIECES = [[_zobrist.getrandbits(64) for _ in range(24)] for _ in range(2)]
+ZOBRIST_HAND = [[_zobrist.getrandbits(64) for _ in range(10)] for _ in range(2)]
+ZOBRIST_TURN = _zobrist.getrandbits(64)
+# Hands of up to MAX_PIECES, drawn last so the keys above stay the same
+for _hand in ZOBRIST_HAND:
+    _hand.extend(_zobrist.getrandbits(64) for _ in range(MAX_PIECES + 1 - len(_hand)))
+
+def squares(mask):
+    """Yield the point numbers of the bits set in mask"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+class Position:
+    """Board state as one 24-bit integer per player plus side to move,
+    pieces in hand and phase.
+
+    Moves are (src, dst, cap) tuples: src is None for a placement and
+    cap is None when no opponent piece is removed.
+    """
+    def __init__(self, pieces=9):
+        self.bits = [0, 0]
+        self.in_hand = [pieces, pieces]
+        self.turn = 0
+        self.moves = []
+        self.undo = []  # State make saves for unmake, one per move
+        self.piece_hash = 0
+        # Plies since the last capture or placement, and how often each
+        # position has occurred since then; earlier positions can never
+        # come back, since pieces only leave the hands and the board
+        self.quiet_plies = 0
+        self.seen = {}
+        # Evaluation terms per side, kept up to date by put and remove
+        self.closed_mills = [0, 0]
+        self.open_twos = [0, 0]  # Two pieces and an empty point on a mill
+        self.mobility = [0, 0]  # Empty points next to the side's pieces
+        self.blocked = [0, 0]  # Pieces with no empty neighbour
+
+    @classmethod
+    def from_board(cls, cells, in_hand=(0, 0), turn=0):
+        """Build a position from a list of ' '/'1'/'2' strings"""
+        position = cls()
+        for i, cell in enumerate(cells):
+            if cell != EMPTY:
+                position.put(i, SIDE[cell])
+        position.in_hand = list(in_hand)
+        position.turn = turn
+        return position
+
+    @classmethod
+    def from_text(cls, text):
+        """Parse the format written by to_text"""
+        cells, hand1, hand2, player = text.split()
+        return cls.from_board([EMPTY if c == '.' else c for c in cells],
+                              (int(hand1), int(hand2)), SIDE[player])
+
+    def to_text(self):
+        """One-line form: the 24 points ('.' for empty), pieces in hand
+        for each player and the player to move, e.g. '1.2.... 7 8 1'"""
+        cells = ''.join('.' if cell == EMPTY else cell for cell in self)
+        return f'{cells} {self.in_hand[0]} {self.in_hand[1]} {PLAYERS[self.turn]}'
+
+    def copy(self):
+        position = Position()
+        position.bits = self.bits[:]
+        position.in_hand = self.in_hand[:]
+        position.turn = self.turn
+        position.piece_hash = self.piece_hash
+        position.closed_mills = self.closed_mills[:]
+        position.open_twos = self.open_twos[:]
+        position.mobility = self.mobility[:]
+        position.blocked = self.blocked[:]
+        position.quiet_plies = self.quiet_plies
+        position.seen = dict(self.seen)
+        return position
+
+    # List-style access so code written against the old board list
+    # (board[i] == '1', board[i] = ' ') keeps working
+    def __getitem__(self, i):
+        bit = 1 << i
+        if self.bits[0] & bit:
+            return '1'
+        if self.bits[1] & bit:
+            return '2'
+        return EMPTY
+
+    def __setitem__(self, i, value):
+        if self.bits[0] >> i & 1:
+            self.remove(i, 0)
+        elif self.bits[1] >> i & 1:
+            self.remove(i, 1)
+        if value != EMPTY:
+            self.put(i, SIDE[value])
+
+    def __len__(self):
+        return 24
+
+    def __iter__(self):
+        return (self[i] for i in range(24))
+
+    def put(self, sq, side):
+        """Place a piece of side on an empty point"""
+        self.update_terms(sq, side, 1)
+        self.bits[side] |= 1 << sq
+        self.piece_hash ^= ZOBRIST_PIECES[side][sq]
+
+    def remove(self, sq, side):
+        """Take the piece of side off a point"""
+        self.bits[side] &= ~(1 << sq)
+        self.piece_hash ^= ZOBRIST_PIECES[side][sq]
+        self.update_terms(sq, side, -1)
+
+    def update_terms(self, sq, side, sign):
+        """Apply (sign 1) or take back (sign -1) the change in the
+        evaluation terms when a piece of side lands on the empty point
+        sq. The bits must not include that piece."""
+        other = side ^ 1
+        own = self.bits[side]
+        theirs = self.bits[other]
+
+        # Only the two mills through sq change
+        open_twos = self.open_twos
+        for mask in MILLS_BY_SQUARE[sq]:
+            mine = (own & mask).bit_count()
+            their = (theirs & mask).bit_count()
+            if their == 0:
+                if mine == 2:
+                    self.closed_mills[side] += sign
+                    open_twos[side] -= sign
+                elif mine == 1:
+                    open_twos[side] += sign
+            elif their == 2 and mine == 0:
+                open_twos[other] -= sign  # Their open two is blocked
+
+        # Only pieces on sq and next to it gain or lose empty neighbours
+        adjacent = ADJACENT_MASKS[sq]
+        empty = FULL & ~(own | theirs | 1 << sq)
+        mobility = self.mobility
+        mobility[side] += sign * ((adjacent & empty).bit_count() - (adjacent & own).bit_count())
+        mobility[other] -= sign * (adjacent & theirs).bit_count()
+        blocked = self.blocked
+        if not adjacent & empty:
+            blocked[side] += sign
+        # Occupied neighbours whose only empty neighbour was sq
+        for n in NEIGHBOURS[sq]:
+            if not ADJACENT_MASKS[n] & empty:
+                if own >> n & 1:
+                    blocked[side] += sign
+                elif theirs >> n & 1:
+                    blocked[other] += sign
+
+    @property
+    def key(self):
+        """Zobrist hash of the pieces, pieces in hand and side to move"""
+        key = (self.piece_hash ^ ZOBRIST_HAND[0][self.in_hand[0]]
+               ^ ZOBRIST_HAND[1][self.in_hand[1]])
+        if self.turn:
+            key ^= ZOBRIST_TURN
+        return key
+
+    @property
+    def empty(self):
+        return FULL & ~(self.bits[0] | self.bits[1])
+
+    def count(self, side):
+        return self.bits[side].bit_count()
+
+    def phase(self, side=None):
+        """Phase for side (default: side to move)"""
+        if side is None:
+            side = self.turn
+        if self.in_hand[side]:
+            return 'placing'
+        if self.count(side) == 3:
+            return 'flying'
+        return 'moving'
+
+    def is_mill(self, sq, side, bits=None):
+        """Check whether the piece on sq closes a mill for side"""
+        if bits is None:
+            bits = self.bits[side]
+        for mask in MILLS_BY_SQUARE[sq]:
+            if bits & mask == mask:
+                return True
+        return False
+
+    def can_move(self, side):
+        if self.count(side) == 3:  # Flying phase
+            return self.empty != 0
+
+        empty = self.empty
+        for sq in squares(self.bits[side]):
+            if ADJACENT_MASKS[sq] & empty:
+                return True
+        return False
+
+    def removable(self, side):
+        """Pieces of side that may be captured: those outside mills, or
+        any of them when every piece stands in a mill"""
+        bits = self.bits[side]
+        free = [sq for sq in squares(bits) if not self.is_mill(sq, side)]
+        return free or list(squares(bits))
+
+    def repetitions(self):
+        """How many times the current position has occurred, counting
+        positions reached by make since the last irreversible move"""
+        return self.seen.get(self.key, 0)
+
+    def note_move(self, move):
+        """Count a move already applied point by point, as main.py
+        does, towards the draw rules the way make would"""
+        src, dst, cap = move
+        if src is None or cap is not None:
+            self.quiet_plies = 0
+            self.seen = {}
+        else:
+            self.quiet_plies += 1
+        key = self.key
+        self.seen[key] = self.seen.get(key, 0) + 1
+
+    def is_lost(self):
+        """Side to move has run out of pieces once placing is over"""
+        side = self.turn
+        return not self.in_hand[side] and self.count(side) < 3
+
+    def make(self, move):
+        """Play a move for the side to move"""
+        src, dst, cap = move
+        side = self.turn
+        terms = (self.closed_mills[:], self.open_twos[:], self.mobility[:],
+                 self.blocked[:])
+        quiet_plies = self.quiet_plies
+        seen = self.seen
+        if not seen:
+            seen[self.key] = 1  # The position play started from
+        if src is None:
+            self.in_hand[side] -= 1
+        else:
+            self.remove(src, side)
+        self.put(dst, side)
+        if cap is not None:
+            self.remove(cap, side ^ 1)
+        self.turn = side ^ 1
+        if src is None or cap is not None:
+            self.quiet_plies = 0
+            self.seen = {}
+        else:
+            self.quiet_plies = quiet_plies + 1
+        key = self.key
+        self.seen[key] = self.seen.get(key, 0) + 1
+        self.moves.append(move)
+        self.undo.append((terms, quiet_plies, seen, key))
+
+    def unmake(self):
+        """Take back the last move played with make"""
+        src, dst, cap = self.moves.pop()
+        side = self.turn ^ 1
+        self.turn = side
+        # Restore the evaluation terms saved by make rather than
+        # updating them piece by piece
+        terms, self.quiet_plies, seen, key = self.undo.pop()
+        self.closed_mills, self.open_twos, self.mobility, self.blocked = terms
+        count = self.seen[key]
+        if count == 1:
+            del self.seen[key]
+        else:
+            self.seen[key] = count - 1
+        self.seen = seen
+        bits = self.bits
+        hashes = ZOBRIST_PIECES[side]
+        if cap is not None:
+            bits[side ^ 1] |= 1 << cap
+            self.piece_hash ^= ZOBRIST_PIECES[side ^ 1][cap]
+        bits[side] &= ~(1 << dst)
+        self.piece_hash ^= hashes[dst]
+        if src is None:
+            self.in_hand[side] += 1
+        else:
+            bits[side] |= 1 << src
+            self.piece_hash ^= hashes[src]
+
+board = Position()
+
 def print_board():
     print("\n" + board[0] + "----------" + board[1] + "----------" + board[2])
     print("|          |          |")
@@ -54,44 +367,38 @@ def print_position_guide():
     print("12---------13---------14\n")
 
 def check_mill(pos, player):
-    for mill in mills:
-        if pos in mill and all(board[p] == player for p in mill):
-            return True
-    return False
+    return board.is_mill(pos, SIDE[player])
 
 def count_pieces(player):
-    return sum(1 for p in board if p == player)
+    return board.count(SIDE[player])
 
 def can_move(player):
-    if count_pieces(player) == 3:  # Flying phase
-        return any(board[i] == ' ' for i in range(24))
-    
-    for i in range(24):
-        if board[i] == player:
-            for neighbor in connections[i]:
-                if board[neighbor] == ' ':
-                    return True
-    return False
+    return board.can_move(SIDE[player])
+
+def encode_move(move):
+    """Pack a (src, dst, cap) move into a 15-bit integer"""
+    src, dst, cap = move
+    return ((24 if src is None else src)
+            | dst << 5
+            | (24 if cap is None else cap) << 10)
+
+def decode_move(code):
+    """Inverse of encode_move"""
+    src = code & 31
+    cap = code >> 10 & 31
+    return (None if src == 24 else src, code >> 5 & 31,
+            None if cap == 24 else cap)
 
 def remove_opponent_piece(opponent):
+    """Ask for a piece to capture; returns its position (None if none)"""
     print("You formed a mill! Remove an opponent's piece.")
     
     # Find removable pieces (not in a mill unless all pieces are in mills)
-    removable = []
-    all_in_mills = []
-    
-    for i in range(24):
-        if board[i] == opponent:
-            if not check_mill(i, opponent):
-                removable.append(i)
-            all_in_mills.append(i)
-    
-    if not removable:
-        removable = all_in_mills
+    removable = board.removable(SIDE[opponent])
     
     if not removable:
         print("No pieces to remove!")
-        return
+        return None
     
     print("Opponent pieces at positions:", removable)
     
@@ -101,7 +408,7 @@ def remove_opponent_piece(opponent):
             if pos in removable:
                 board[pos] = ' '
                 print("Piece removed!")
-                break
+                return pos
             else:
                 print("Invalid position! Choose from:", removable)
         except:
@@ -0,0 +1,77 @@
+"""Per-decision statistics from MorrisAI.
+
+    ai = MorrisAI(5)
+    ai.add_hook(JsonlSink('decisions.jsonl'))
+    ai.add_hook(LatencyAlert(0.5, print))
+
+Hooks are called with one dict per decision:
+
+    call                 make_move, choose_piece_to_remove or choose_move
+    player, difficulty
+    phase                placing, moving or flying
+    position             Position.to_text() of the position decided in
+    source               book, cache or search
+    move, capture        what was chosen (either may be missing)
+    score, depth         for searched moves, from the AI's point of view
+    nodes, tt_probes, tt_hits, tt_hit_rate, tt_cutoffs, cutoffs
+    seconds              wall time of the whole call
+    move_seconds, capture_seconds, generation_seconds, evaluation_seconds
+
+Without hooks nothing is recorded and the search runs untimed.
+"""
+import json
+import time
+
+def new_record(ai, call, phase):
+    return {
+        'call': call,
+        'player': ai.player,
+        'difficulty': ai.difficulty,
+        'phase': phase,
+        'position': ai.root_position().to_text(),
+        'source': None,
+        'started': time.time(),
+        '_clock': time.perf_counter(),
+    }
+
+def finish_record(record):
+    record['seconds'] = time.perf_counter() - record.pop('_clock')
+    return record
+
+def add_search_stats(record, search, score, depth):
+    record['source'] = 'search'
+    record['score'] = score
+    record['depth'] = depth
+    record.update(search.stats())
+    times = getattr(search, 'times', None)
+    if times:
+        record['generation_seconds'] = times['generation']
+        record['evaluation_seconds'] = times['evaluation']
+
+class JsonlSink:
+    """Hook appending every record as one line of JSON to a file"""
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class LatencyAlert:
+    """Hook calling callback(record) for decisions slower than seconds"""
+    def __init__(self, seconds, callback):
+        self.seconds = seconds
+        self.callback = callback
+
+    def __call__(self, record):
+        if record['seconds'] > self.seconds:
+            self.callback(record)
@@ -1,21 +1,44 @@
 # Nine Men's Morris Game with AI opponent
+import random
 from helper import ( board,
     connections, print_board, print_position_guide,
-    check_mill, count_pieces, can_move, remove_opponent_piece
+    check_mill, count_pieces, can_move, remove_opponent_piece,
+    NO_CAPTURE_PLIES
 )
 from ai import MorrisAI
+from records import GameRecord, RecordWriter, format_move
+
+# Finished games are appended here
+RECORD_FILE = 'games.txt'
+
+# Moves suggested by 'help', and seconds spent finding them
+HINT_MOVES = 3
+HINT_SECONDS = 1.0
+
+def print_hint(ai):
+    """Suggest the best moves for the player to move"""
+    lines = ai.analyse(HINT_MOVES, HINT_SECONDS)
+    ai.ponder()  # analyse stopped the AI thinking ahead
+    print("Suggested moves (4 = place at 4, 3-4 = move 3 to 4, x19 = remove 19):")
+    for line in lines:
+        reply = ' '.join(format_move(move) for move in line['pv'][1:4])
+        print(f"  {format_move(line['move']):8} score {line['score']:+d}"
+              + (f", then {reply}" if reply else ""))
 
 # Modified main game loop
 def play_game():
-    global player1_pieces, player2_pieces, player1_placed, player2_placed, current_player, phase
+    global player1_pieces, player2_pieces, current_player, phase
     
-    # Game state
+    # Game state (pieces still to place live in board.in_hand)
     player1_pieces = 9
     player2_pieces = 9
-    player1_placed = 0
-    player2_placed = 0
+    board.in_hand = [player1_pieces, player2_pieces]
+    board.turn = 0
     current_player = '1'
     phase = 'placing'
+    moves = []  # (src, dst, cap) of every move, for the game record
+    result = '*'
+    reason = None
     
     # Get AI difficulty
     print("Welcome to Nine Men's Morris!")
@@ -36,7 +59,9 @@ def play_game():
         except:
             print("Please enter a valid number!")
     
-    ai = MorrisAI(difficulty)
+    # Kept in the game record, so the AI's choices can be replayed
+    seed = random.randrange(1 << 32)
+    ai = MorrisAI(difficulty, seed=seed)
     print(f"\nYou're playing against AI difficulty level {difficulty}")
     print("Type 'help' anytime to see the position guide.")
     
@@ -49,14 +74,28 @@ def play_game():
             if count_pieces(opponent) < 3:
                 winner = "You" if current_player == '1' else "AI"
                 print(f"{winner} win! Opponent has less than 3 pieces.")
+                result = '1-0' if current_player == '1' else '0-1'
+                reason = f'player {opponent} has less than 3 pieces'
                 break
             if not can_move(opponent):
                 winner = "You" if current_player == '1' else "AI"
                 print(f"{winner} win! Opponent cannot move.")
+                result = '1-0' if current_player == '1' else '0-1'
+                reason = f'player {opponent} cannot move'
+                break
+            if board.repetitions() >= 3:
+                print("Draw! The same position has occurred three times.")
+                result = '1/2-1/2'
+                reason = 'position repeated 3 times'
+                break
+            if board.quiet_plies >= NO_CAPTURE_PLIES:
+                print(f"Draw! No piece has been captured in {NO_CAPTURE_PLIES} moves.")
+                result = '1/2-1/2'
+                reason = f'{NO_CAPTURE_PLIES} plies without a capture'
                 break
         
         # Determine game phase
-        if player1_placed < 9 or player2_placed < 9:
+        if board.in_hand[0] or board.in_hand[1]:
             phase = 'placing'
         elif count_pieces(current_player) == 3:
             phase = 'flying'
@@ -64,28 +103,32 @@ def play_game():
             phase = 'moving'
         
         if current_player == '1':
-            # Human player turn
+            # Human player turn; the AI thinks ahead meanwhile
             print(f"\nYour turn ({phase} phase)")
+            ai.ponder()
             
             if phase == 'placing':
-                pieces_left = player1_pieces - player1_placed
+                pieces_left = board.in_hand[0]
                 print(f"Pieces left to place: {pieces_left}")
                 
                 while True:
                     move = input("Enter position to place piece (or 'help'): ")
                     if move == 'help':
                         print_position_guide()
+                        print_hint(ai)
                         continue
                     
                     try:
                         pos = int(move)
                         if 0 <= pos <= 23 and board[pos] == ' ':
                             board[pos] = current_player
-                            player1_placed += 1
+                            board.in_hand[0] -= 1
                             
+                            target = None
                             if check_mill(pos, current_player):
                                 print_board()
-                                remove_opponent_piece(opponent)
+                                target = remove_opponent_piece(opponent)
+                            moves.append((None, pos, target))
                             break
                         else:
                             print("Invalid position! Choose an empty spot (0-23).")
@@ -100,6 +143,7 @@ def play_game():
                     move = input("Enter move as 'from to' (e.g., '0 1') or 'help': ")
                     if move == 'help':
                         print_position_guide()
+                        print_hint(ai)
                         continue
                     
                     try:
@@ -115,9 +159,11 @@ def play_game():
                                     board[from_pos] = ' '
                                     board[to_pos] = current_player
                                     
+                                    target = None
                                     if check_mill(to_pos, current_player):
                                         print_board()
-                                        remove_opponent_piece(opponent)
+                                        target = remove_opponent_piece(opponent)
+                                    moves.append((from_pos, to_pos, target))
                                     break
                                 else:
                                     print("You can only move to adjacent positions!")
@@ -133,15 +179,16 @@ def play_game():
             print(f"\nAI's turn ({phase} phase)")
             
             if phase == 'placing':
-                pieces_left = player2_pieces - player2_placed
+                pieces_left = board.in_hand[1]
                 print(f"AI pieces left to place: {pieces_left}")
                 
                 pos = ai.make_move(phase, pieces_left)
                 if pos is not None:
                     print(f"AI places piece at position {pos}")
                     board[pos] = current_player
-                    player2_placed += 1
+                    board.in_hand[1] -= 1
                     
+                    target = None
                     if check_mill(pos, current_player):
                         print_board()
                         print("AI formed a mill!")
@@ -150,6 +197,7 @@ def play_game():
                         if target is not None:
                             print(f"AI removes your piece at position {target}")
                             board[target] = ' '
+                    moves.append((None, pos, target))
             
             else:  # Moving or flying phase
                 if phase == 'flying':
@@ -162,6 +210,7 @@ def play_game():
                     board[from_pos] = ' '
                     board[to_pos] = current_player
                     
+                    target = None
                     if check_mill(to_pos, current_player):
                         print_board()
                         print("AI formed a mill!")
@@ -169,10 +218,17 @@ def play_game():
                         if target is not None:
                             print(f"AI removes your piece at position {target}")
                             board[target] = ' '
+                    moves.append((from_pos, to_pos, target))
         
         # Switch players
         current_player = '2' if current_player == '1' else '1'
+        board.turn ^= 1
+        if moves:
+            board.note_move(moves[-1])
     
+    ai.close()
+    with RecordWriter(RECORD_FILE) as writer:
+        writer.write(GameRecord(moves, 9, result, reason, {'ai_difficulty': difficulty, 'ai_seed': seed}))
     print("\nGame Over! Thanks for playing!")
 
 # Run the game
@@ -0,0 +1,242 @@
+"""Monte Carlo tree search, an alternative to the alpha-beta Search.
+
+    MorrisAI(5, engine='mcts', time_limit=1.0)
+
+UCT selection over complete (src, dst, cap) moves, so a mill and its
+capture are one edge. Playouts follow simple rules: close a mill if
+possible, else block one, else move at random. Nodes live in
+flat arrays indexed by node number; the children of a node are
+contiguous. After each search the tree is kept, and the next search
+starts from the subtree of the moves actually played when it finds
+them.
+"""
+import math
+import random
+import time
+from array import array
+from functools import partial
+from helper import encode_move, decode_move, NO_CAPTURE_PLIES
+from movegen import legal_moves, steps, forms_mill
+from evaluate import evaluate
+
+# Exploration constant of UCT
+EXPLORATION = 1.4
+
+# Playouts longer than this are scored with the static evaluation
+PLAYOUT_PLIES = 150
+
+# Scale from evaluation scores to a playout result in (0, 1)
+EVAL_SCALE = 0.02
+
+# How many iterations to run between clock checks
+CHECK_EVERY = 16
+
+class MCTS:
+    """Anytime UCT search with the interface of Search.run"""
+    def __init__(self, seed=None, exploration=EXPLORATION, weights=None,
+                 draw_plies=NO_CAPTURE_PLIES):
+        self.rng = random.Random(seed)
+        self.exploration = exploration
+        # Cut-off playouts are scored like Search scores its leaves, and
+        # draw_plies plies without a capture draw a game as in Search
+        self.evaluate = evaluate if weights is None else partial(evaluate, w=weights)
+        self.draw_plies = draw_plies
+        self.nodes = 0  # Iterations of the last run
+        self.reused = 0  # Nodes carried over into the last run
+        self.max_depth = 0
+        self.stop = None
+        self.timing = False
+        self.root = None  # Position of node 0
+        self.clear()
+
+    def clear(self):
+        self.parent = array('i', [-1])
+        self.first = array('i', [-1])  # First child, -1 until expanded
+        self.count = array('H', [0])  # Number of children
+        self.move = array('H', [0])  # encode_move of the edge into the node
+        self.visits = array('I', [0])
+        self.value = array('d', [0.0])  # Results for the side that moved
+
+    def run(self, position, max_depth=None, time_limit=None, max_nodes=None):
+        """Search until time_limit seconds or max_nodes iterations;
+        returns (move, score, depth) like Search.run, with the score
+        the win rate mapped to -1000..1000 and depth the deepest node.
+        max_depth is accepted for compatibility and ignored."""
+        if max_nodes is None and time_limit is None:
+            max_nodes = 1000
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        self.reroot(position)
+        if self.first[0] < 0:
+            self.expand(0, self.root)
+        self.nodes = 0
+        self.max_depth = 0
+        if not any(True for _ in legal_moves(position)):
+            return None, -1000, 0
+
+        while True:
+            self.iterate()
+            self.nodes += 1
+            if max_nodes is not None and self.nodes >= max_nodes:
+                break
+            if self.nodes % CHECK_EVERY == 0:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                if self.stop is not None and self.stop.is_set():
+                    break
+
+        best = max(range(self.first[0], self.first[0] + self.count[0]),
+                   key=self.visits.__getitem__)
+        rate = self.value[best] / self.visits[best] if self.visits[best] else 0.5
+        return decode_move(self.move[best]), round((2 * rate - 1) * 1000), self.max_depth
+
+    def iterate(self):
+        """One selection, expansion, playout and backup"""
+        position = self.root.copy()
+        node = 0
+        depth = 0
+        while self.first[node] >= 0 and self.count[node]:
+            node = self.select(node)
+            position.make(decode_move(self.move[node]))
+            depth += 1
+        # A lost or drawn position ends the game: it is never expanded,
+        # and the playout scores it at once
+        lost = position.is_lost()
+        over = lost or position.quiet_plies >= self.draw_plies
+        if self.first[node] < 0 and self.visits[node] and not over:
+            # Second visit: expand and step into the first child
+            self.expand(node, position)
+            if self.count[node]:
+                node = self.first[node]
+                position.make(decode_move(self.move[node]))
+                depth += 1
+                lost = position.is_lost()
+        self.max_depth = max(self.max_depth, depth)
+
+        # result is for the side to move at the end of the path
+        result = 0.0 if lost else self.playout(position)
+        while node >= 0:
+            self.visits[node] += 1
+            self.value[node] += 1 - result  # The parent's side moved here
+            result = 1 - result
+            node = self.parent[node]
+
+    def select(self, node):
+        first = self.first[node]
+        log_total = math.log(self.visits[node] or 1)
+        visits = self.visits
+        value = self.value
+        best = first
+        best_score = -1.0
+        for child in range(first, first + self.count[node]):
+            n = visits[child]
+            if n == 0:
+                return child
+            score = value[child] / n + self.exploration * math.sqrt(log_total / n)
+            if score > best_score:
+                best = child
+                best_score = score
+        return best
+
+    def expand(self, node, position):
+        moves = list(legal_moves(position))
+        self.rng.shuffle(moves)
+        self.first[node] = len(self.parent)
+        self.count[node] = len(moves)
+        for move in moves:
+            self.parent.append(node)
+            self.first.append(-1)
+            self.count.append(0)
+            self.move.append(encode_move(move))
+            self.visits.append(0)
+            self.value.append(0.0)
+
+    def playout(self, position):
+        """Play on with the playout policy; 1 if the side to move at
+        the start wins, 0 if it loses, 0.5 for a draw, in between when
+        cut off"""
+        side = position.turn
+        rng = self.rng
+        for _ in range(PLAYOUT_PLIES):
+            if position.is_lost():
+                return 0.0 if position.turn == side else 1.0
+            if position.quiet_plies >= self.draw_plies:
+                return 0.5
+            move = playout_move(position, rng)
+            if move is None:
+                return 0.0 if position.turn == side else 1.0
+            position.make(move)
+        score = self.evaluate(position)
+        if position.turn != side:
+            score = -score
+        return 1 / (1 + math.exp(-EVAL_SCALE * score))
+
+    def reroot(self, position):
+        """Keep the subtree for position if it is the root or lies up
+        to two moves below it; start a new tree otherwise"""
+        key = position.key
+        node = None
+        if self.root is not None:
+            node = self.find(key, self.root.copy(), 0, 2)
+        if node is None:
+            self.clear()
+        elif node:
+            self.extract(node)
+        self.reused = len(self.parent) - 1
+        self.root = position.copy()
+
+    def find(self, key, position, node, depth):
+        if position.key == key:
+            return node
+        if depth == 0 or self.first[node] < 0:
+            return None
+        for child in range(self.first[node], self.first[node] + self.count[node]):
+            position.make(decode_move(self.move[child]))
+            found = self.find(key, position, child, depth - 1)
+            position.unmake()
+            if found is not None:
+                return found
+        return None
+
+    def extract(self, node):
+        """Make node the root, dropping everything outside its subtree"""
+        old = (self.first, self.count, self.move, self.visits, self.value)
+        first, count, move, visits, value = old
+        self.clear()
+        self.visits[0] = visits[node]
+        self.value[0] = value[node]
+        queue = [(node, 0)]
+        for old_node, new_node in queue:
+            if first[old_node] < 0:
+                continue
+            self.first[new_node] = len(self.parent)
+            self.count[new_node] = count[old_node]
+            for child in range(first[old_node], first[old_node] + count[old_node]):
+                queue.append((child, len(self.parent)))
+                self.parent.append(new_node)
+                self.first.append(-1)
+                self.count.append(0)
+                self.move.append(move[child])
+                self.visits.append(visits[child])
+                self.value.append(value[child])
+
+    def stats(self):
+        return {'nodes': self.nodes, 'tree_nodes': len(self.parent),
+                'reused_nodes': self.reused, 'depth': self.max_depth}
+
+def playout_move(position, rng):
+    """Playout policy: close a mill, else block one, else any move;
+    a capture takes a random removable piece"""
+    side = position.turn
+    other = side ^ 1
+    candidates = steps(position, side)
+    if not candidates:
+        return None
+    mills = [step for step in candidates if forms_mill(position, side, *step)]
+    if mills:
+        src, dst = rng.choice(mills)
+        captures = position.removable(other)
+        return (src, dst, rng.choice(captures) if captures else None)
+    theirs = position.bits[other]
+    blocks = [step for step in candidates if position.is_mill(step[1], other, theirs | 1 << step[1])]
+    src, dst = rng.choice(blocks or candidates)
+    return (src, dst, None)
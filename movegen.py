@@ -0,0 +1,108 @@
+from helper import ADJACENT_MASKS, squares
+
+def placements(position):
+    """(None, dst) steps placing a new piece on any empty point"""
+    return [(None, dst) for dst in squares(position.empty)]
+
+def slides(position, side):
+    """(src, dst) steps moving a piece of side to an adjacent empty point"""
+    empty = position.empty
+    return [(src, dst) for src in squares(position.bits[side])
+            for dst in squares(ADJACENT_MASKS[src] & empty)]
+
+def flights(position, side):
+    """(src, dst) steps flying a piece of side to any empty point"""
+    empty = list(squares(position.empty))
+    return [(src, dst) for src in squares(position.bits[side]) for dst in empty]
+
+def steps(position, side=None):
+    """Placements, slides or flights, whichever the phase of side allows"""
+    if side is None:
+        side = position.turn
+    if position.in_hand[side]:
+        return placements(position)
+    if position.count(side) == 3:
+        return flights(position, side)
+    return slides(position, side)
+
+def forms_mill(position, side, src, dst):
+    """Check whether moving src to dst (src None to place) closes a mill"""
+    after = position.bits[side] | 1 << dst
+    if src is not None:
+        after &= ~(1 << src)
+    return position.is_mill(dst, side, after)
+
+def expand(position, src, dst):
+    """Complete moves for one step: one per legal capture if the step
+    closes a mill, otherwise the step alone"""
+    side = position.turn
+    if forms_mill(position, side, src, dst):
+        captures = position.removable(side ^ 1)
+        if captures:
+            return [(src, dst, cap) for cap in captures]
+    return [(src, dst, None)]
+
+def legal_moves(position):
+    """Yield every legal (src, dst, cap) move for the side to move"""
+    for src, dst in steps(position):
+        yield from expand(position, src, dst)
+
+def is_legal(position, move):
+    """Check a move from outside the generator, e.g. a hash move"""
+    src, dst, cap = move
+    side = position.turn
+    if not position.empty >> dst & 1:
+        return False
+    if src is None:
+        if not position.in_hand[side]:
+            return False
+    elif position.in_hand[side] or not position.bits[side] >> src & 1:
+        return False
+    elif position.count(side) != 3 and not ADJACENT_MASKS[src] >> dst & 1:
+        return False
+    return move in expand(position, src, dst)
+
+def ordered_moves(position, hash_move=None, killers=(), history=None):
+    """Yield legal moves lazily in search order: hash move, moves that
+    close a mill, killer moves, then the rest by history score.
+
+    Each stage is only built once the previous one is used up, so a
+    cutoff early in the list skips the work for the later ones.
+    """
+    side = position.turn
+    if hash_move is not None and is_legal(position, hash_move):
+        yield hash_move
+
+    quiet = []
+    captures = None
+    for src, dst in steps(position, side):
+        if forms_mill(position, side, src, dst):
+            if captures is None:
+                captures = position.removable(side ^ 1)
+            if captures:
+                for cap in captures:
+                    move = (src, dst, cap)
+                    if move != hash_move:
+                        yield move
+                continue
+        quiet.append((src, dst, None))
+
+    for move in killers:
+        if move is not None and move != hash_move and move in quiet:
+            quiet.remove(move)
+            yield move
+
+    if history is not None:
+        scores = history[side]
+        quiet.sort(key=lambda move: scores[history_index(move)], reverse=True)
+    for move in quiet:
+        if move != hash_move:
+            yield move
+
+def history_index(move):
+    """Slot of a quiet move in a history table of 25 * 24 entries"""
+    src, dst, cap = move
+    return (24 if src is None else src) * 24 + dst
+
+def new_history():
+    return [[0] * (25 * 24) for _ in range(2)]
@@ -0,0 +1,136 @@
+"""Lazy-SMP parallel search over a process pool.
+
+Every worker searches the same root with its own move order, all of
+them reading and writing one transposition table held in
+multiprocessing.shared_memory. The workers feed each other's tables,
+so the main worker reaches greater depths within the same deadline.
+"""
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+from search import Search
+from helper import NO_CAPTURE_PLIES
+from ttable import TranspositionTable, table_bytes
+
+# Per-process state of pool workers
+_worker = {}
+
+def _attach(name, tt_size_mb, stop, tablebase_dir, weights, draw_plies):
+    """Pool initializer: open the shared table once per worker process"""
+    shm = shared_memory.SharedMemory(name=name)
+    tablebase = None
+    if tablebase_dir is not None:
+        from tablebase import Tablebase
+        tablebase = Tablebase(tablebase_dir)
+    _worker['shm'] = shm
+    _worker['tt'] = TranspositionTable(tt_size_mb, buffer=shm.buf)
+    _worker['stop'] = stop
+    _worker['tablebase'] = tablebase
+    _worker['weights'] = weights
+    _worker['draw_plies'] = draw_plies
+    _worker['searches'] = {}
+
+def _search(job):
+    """Pool task: one worker's share of a parallel search"""
+    helper_id, position, age, max_depth, time_limit, max_nodes = job
+    searches = _worker['searches']
+    if helper_id not in searches:
+        searches[helper_id] = Search(tt=_worker['tt'], tablebase=_worker['tablebase'],
+                                     helper_id=helper_id, weights=_worker['weights'])
+        searches[helper_id].draw_plies = _worker['draw_plies']
+    search = searches[helper_id]
+    search.stop = _worker['stop']
+    search.tt.age = age
+    started = time.perf_counter()
+    move, score, depth = search.run(position, max_depth, time_limit, max_nodes)
+    elapsed = time.perf_counter() - started
+    if helper_id == 0:
+        # The main worker decides; tell the helpers to stop
+        _worker['stop'].set()
+    return helper_id, move, score, depth, search.nodes, elapsed, search.stats()
+
+class ParallelSearch:
+    """Drop-in for Search.run using several worker processes.
+
+    Use as a context manager or call close() to release the pool and
+    the shared memory.
+    """
+    def __init__(self, workers=4, tt_size_mb=64, tablebase_dir=None, weights=None,
+                 draw_plies=NO_CAPTURE_PLIES):
+        self.workers = workers
+        self.shm = shared_memory.SharedMemory(create=True, size=table_bytes(tt_size_mb))
+        self.tt = TranspositionTable(tt_size_mb, buffer=self.shm.buf)
+        self.stop = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(
+            workers, initializer=_attach,
+            initargs=(self.shm.name, tt_size_mb, self.stop, tablebase_dir, weights,
+                      draw_plies))
+        self.nodes = 0
+        self.totals = {}
+        self.report = None
+
+    def run(self, position, max_depth=64, time_limit=None, max_nodes=None):
+        """Search with every worker; returns (move, score, depth) like
+        Search.run and leaves per-worker statistics in self.report"""
+        self.tt.new_search()
+        self.stop.clear()
+        started = time.perf_counter()
+        jobs = [(helper_id, position.copy(), self.tt.age, max_depth, time_limit, max_nodes)
+                for helper_id in range(self.workers)]
+        results = sorted(self.pool.map(_search, jobs, chunksize=1))
+        elapsed = time.perf_counter() - started
+
+        # Prefer the deepest finished iteration, the main worker on ties
+        _, move, score, depth, _, _, _ = max(results, key=lambda r: (r[3], r[0] == 0))
+        self.nodes = sum(r[4] for r in results)
+        self.totals = {name: sum(r[6][name] for r in results)
+                       for name in ('tt_probes', 'tt_hits', 'tt_cutoffs', 'cutoffs')}
+        self.report = {
+            'workers': [{'worker': r[0], 'depth': r[3], 'nodes': r[4],
+                         'nodes_per_second': round(r[4] / r[5]) if r[5] else 0}
+                        for r in results],
+            'depth': depth,
+            'nodes': self.nodes,
+            'seconds': elapsed,
+            'nodes_per_second': round(self.nodes / elapsed) if elapsed else 0,
+        }
+        return move, score, depth
+
+    def stats(self):
+        """Counters of the last run, summed over the workers"""
+        stats = dict(self.totals, nodes=self.nodes)
+        probes = stats.get('tt_probes', 0)
+        stats['tt_hit_rate'] = stats.get('tt_hits', 0) / probes if probes else 0.0
+        return stats
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.tt.words.release()
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def measure_speedup(position, depth, workers=4, tt_size_mb=64):
+    """Time to reach depth with one search and with workers processes;
+    returns the ratio along with both reports"""
+    started = time.perf_counter()
+    single = Search(tt_size_mb)
+    single.run(position, max_depth=depth)
+    single_seconds = time.perf_counter() - started
+
+    with ParallelSearch(workers, tt_size_mb) as parallel:
+        parallel.run(position, max_depth=depth)
+        report = parallel.report
+    return {
+        'depth': depth,
+        'single_seconds': single_seconds,
+        'single_nodes_per_second': round(single.nodes / single_seconds) if single_seconds else 0,
+        'parallel': report,
+        'speedup': single_seconds / report['seconds'] if report['seconds'] else None,
+    }
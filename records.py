@@ -0,0 +1,268 @@
+"""Game records: a compact text form, a packed binary form, and
+streaming replay and analysis of large record files.
+
+Text files hold one game per line: a JSON header, a tab, then the
+moves separated by spaces.
+
+    {"pieces": 9, "result": "1-0", "reason": "..."}<TAB>4 10 3 ... 4-5x19
+
+A move is written '4' (place on 4), '3-4' (move or fly from 3 to 4),
+either followed by 'x19' when it captures the piece on 19. Binary files
+start with MAGIC and VERSION; every game is a header (pieces, result,
+length of the JSON metadata, number of moves), the metadata and one
+encode_move() word per move.
+
+    python records.py analyse games.bin --workers 8 --difficulty 5
+"""
+import argparse
+import json
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from helper import encode_move, decode_move, PLAYERS
+from game import Game
+
+MAGIC = b'NMMGR'
+VERSION = 1
+FILE_HEADER = struct.Struct('<5sB')
+GAME_HEADER = struct.Struct('<BBHH')
+
+# Results as stored in binary files
+RESULTS = ('*', '1-0', '0-1', '1/2-1/2')
+
+class GameRecord:
+    """Moves of one game with its result and free-form metadata"""
+    def __init__(self, moves=(), pieces=9, result='*', reason=None, meta=None):
+        self.moves = list(moves)
+        self.pieces = pieces
+        self.result = result
+        self.reason = reason
+        self.meta = {} if meta is None else meta
+
+    @classmethod
+    def from_game(cls, game, **meta):
+        if not game.over:
+            result = '*'
+        elif game.winner is None:
+            result = '1/2-1/2'
+        else:
+            result = '1-0' if game.winner == PLAYERS[0] else '0-1'
+        pieces = game.pieces
+        return cls(game.moves, pieces, result, game.reason, meta)
+
+    def header(self):
+        header = {'pieces': self.pieces, 'result': self.result}
+        if self.reason is not None:
+            header['reason'] = self.reason
+        header.update(self.meta)
+        return header
+
+    def to_text(self):
+        moves = ' '.join(format_move(move) for move in self.moves)
+        return json.dumps(self.header()) + '\t' + moves
+
+    @classmethod
+    def from_text(cls, line):
+        header, _, moves = line.rstrip('\n').partition('\t')
+        meta = json.loads(header)
+        return cls([parse_move(text) for text in moves.split()],
+                   meta.pop('pieces', 9), meta.pop('result', '*'),
+                   meta.pop('reason', None), meta)
+
+    def to_bytes(self):
+        meta = {key: value for key, value in self.header().items()
+                if key not in ('pieces', 'result')}
+        meta = json.dumps(meta).encode() if meta else b''
+        return (GAME_HEADER.pack(self.pieces, RESULTS.index(self.result),
+                                 len(meta), len(self.moves))
+                + meta + struct.pack(f'<{len(self.moves)}H',
+                                     *map(encode_move, self.moves)))
+
+def format_move(move):
+    src, dst, cap = move
+    text = str(dst) if src is None else f'{src}-{dst}'
+    return text if cap is None else f'{text}x{cap}'
+
+def parse_move(text):
+    """Inverse of format_move"""
+    step, _, cap = text.partition('x')
+    src, _, dst = step.rpartition('-')
+    return (int(src) if src else None, int(dst), int(cap) if cap else None)
+
+class RecordWriter:
+    """Append records to a file, binary when the name ends in .bin"""
+    def __init__(self, path):
+        self.binary = path.endswith('.bin')
+        if self.binary:
+            self.file = open(path, 'ab')
+            if self.file.tell() == 0:
+                self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        else:
+            self.file = open(path, 'a')
+
+    def write(self, record):
+        self.file.write(record.to_bytes() if self.binary else record.to_text() + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_records(path):
+    """Yield the records of a text or binary file one at a time"""
+    with open(path, 'rb') as f:
+        start = f.read(FILE_HEADER.size)
+        if len(start) == FILE_HEADER.size and FILE_HEADER.unpack(start)[0] == MAGIC:
+            if FILE_HEADER.unpack(start)[1] != VERSION:
+                raise ValueError(f'{path}: unsupported record version')
+            yield from read_binary(f)
+            return
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield GameRecord.from_text(line)
+
+def read_binary(f):
+    while True:
+        header = f.read(GAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < GAME_HEADER.size:
+            raise ValueError('truncated game record')
+        pieces, result, meta_size, count = GAME_HEADER.unpack(header)
+        meta = f.read(meta_size)
+        data = f.read(2 * count)
+        if len(meta) < meta_size or len(data) < 2 * count:
+            raise ValueError('truncated game record')
+        moves = struct.unpack(f'<{count}H', data)
+        meta = json.loads(meta) if meta else {}
+        yield GameRecord(map(decode_move, moves), pieces, RESULTS[result],
+                         meta.pop('reason', None), meta)
+
+def replay(record):
+    """Yield (game, move) before each move, checking every move against
+    the rules; raises ValueError at the first illegal one"""
+    game = Game(record.pieces)
+    for ply, move in enumerate(record.moves):
+        yield game, move
+        try:
+            game.play(move)
+        except ValueError as e:
+            raise ValueError(f'ply {ply + 1}: {e}') from None
+
+# Per-process engines of analysis workers, by player and options
+_engines = {}
+
+def analyse_record(job):
+    """Worker: the engine's choice and score in every position of a game.
+    With a 'lines' option of K, MorrisAI.analyse ranks the best K moves
+    of every position instead, in one search each."""
+    record, options = job
+    from ai import MorrisAI
+    plies = []
+    options = dict(options)
+    count = options.pop('lines', 0)
+    settings = tuple(sorted(options.items()))
+    try:
+        for game, played in replay(record):
+            player = game.current_player
+            ai = _engines.get((player, settings))
+            if ai is None:
+                ai = MorrisAI(position=game.position, player=player, **options)
+                _engines[player, settings] = ai
+            ai.position = game.position
+            if count:
+                lines = ai.analyse(count)
+                best = lines[0]['move'] if lines else None
+                score, depth = (lines[0]['score'], lines[0]['depth']) if lines else (None, None)
+            else:
+                # Read from the AI rather than a hook, which would time
+                # every decision
+                best = ai.choose_move()
+                score = ai.last_score
+                depth = None if score is None else ai.last_depth
+            ply = {'played': format_move(played),
+                   'best': None if best is None else format_move(best),
+                   'agree': best == played,
+                   'score': score, 'depth': depth}
+            if count:
+                ply['lines'] = [{'move': format_move(line['move']), 'score': line['score'],
+                                 'pv': ' '.join(map(format_move, line['pv']))}
+                                for line in lines]
+            plies.append(ply)
+    except ValueError as e:
+        return {'header': record.header(), 'error': str(e), 'plies': plies}
+    agreed = sum(ply['agree'] for ply in plies)
+    return {'header': record.header(), 'plies': plies,
+            'agreement': agreed / len(plies) if plies else None}
+
+def analyse(records, workers=None, window=None, **options):
+    """Analyse records with MorrisAI(**options) over a process pool,
+    yielding one result per game in input order. At most window games
+    are in flight, so memory stays bounded however many there are."""
+    if window is None:
+        window = 4 * (workers or 4)
+    pending = []
+    with ProcessPoolExecutor(workers) as pool:
+        for record in records:
+            pending.append(pool.submit(analyse_record, (record, options)))
+            if len(pending) >= window:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and analyse game records')
+    sub = parser.add_subparsers(dest='command', required=True)
+    check = sub.add_parser('check', help='replay every game and report illegal moves')
+    check.add_argument('path')
+    convert = sub.add_parser('convert', help='rewrite a file in the other format')
+    convert.add_argument('path')
+    convert.add_argument('out', help='output file; binary if it ends in .bin')
+    run = sub.add_parser('analyse', help='re-analyse every position, one JSON line per game')
+    run.add_argument('path')
+    run.add_argument('--workers', type=int, default=None)
+    run.add_argument('--difficulty', type=int, default=5)
+    run.add_argument('--time-limit', type=float, default=0.1)
+    run.add_argument('--lines', type=int, default=0,
+                     help='rank this many moves per position, with scores and variations')
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        games = bad = 0
+        records = read_records(args.path)
+        while True:
+            try:
+                record = next(records, None)
+            except ValueError as e:
+                # A damaged file cannot be read past the damage
+                print(f'game {games + 1}: {e}; the rest of the file is unreadable')
+                break
+            if record is None:
+                break
+            games += 1
+            try:
+                for _ in replay(record):
+                    pass
+            except ValueError as e:
+                bad += 1
+                print(f'game {games}: {e}')
+        print(f'{games} games, {bad} with illegal moves')
+    elif args.command == 'convert':
+        with RecordWriter(args.out) as writer:
+            for record in read_records(args.path):
+                writer.write(record)
+    else:
+        for result in analyse(read_records(args.path), args.workers,
+                              difficulty=args.difficulty, time_limit=args.time_limit,
+                              tt_size_mb=4, lines=args.lines):
+            print(json.dumps(result))
+            sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
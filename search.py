@@ -0,0 +1,298 @@
+import random
+import time
+from functools import partial
+from evaluate import WIN, evaluate, noisy_evaluate, WEIGHTS
+from ttable import TranspositionTable, EXACT, LOWER, UPPER
+from tablebase import DRAW
+from helper import NO_CAPTURE_PLIES
+from movegen import ordered_moves, history_index, new_history, is_legal
+
+MAX_PLY = 128
+
+# How many nodes to visit between clock checks
+CHECK_EVERY = 1024
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time or node budget runs out"""
+
+class Search:
+    """Negamax alpha-beta search with iterative deepening.
+
+    Covers the placing, moving and flying phases; captures are part of
+    the move, so a mill and the piece it removes are searched together.
+    """
+    def __init__(self, tt_size_mb=16, tablebase=None, tt=None, helper_id=0, weights=None,
+                 noise=0, salt=0):
+        self.nodes = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.cutoffs = 0
+        # With timing on, seconds spent generating moves and evaluating
+        # leaves are added up in self.times (this slows the search)
+        self.timing = False
+        self.times = {'generation': 0.0, 'evaluation': 0.0}
+        # Evaluation weights other than evaluate.WEIGHTS (see tune.py),
+        # and noise of up to +/- noise points, varying with salt
+        if noise:
+            self.static_eval = partial(noisy_evaluate, salt=salt, spread=noise,
+                                       w=WEIGHTS if weights is None else weights)
+        elif weights is None:
+            self.static_eval = evaluate
+        else:
+            self.static_eval = partial(evaluate, w=weights)
+        self.generate = ordered_moves
+        self.evaluate = self.static_eval
+        self.deadline = None
+        self.max_nodes = None
+        self.lines = []  # Best moves of the last run, see run(count=...)
+        # Kept between calls so later moves reuse earlier results
+        self.tt = TranspositionTable(tt_size_mb) if tt is None else tt
+        # A table passed in belongs to its owner, which advances its age
+        # once per search (ParallelSearch.run for the shared table)
+        self.owns_tt = tt is None
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = new_history()
+        self.tablebase = tablebase
+        # Anything with is_set(); once set, the search stops at the next
+        # budget check as if its time had run out
+        self.stop = None
+        # Helpers in a parallel search (helper_id > 0) share the main
+        # search's table and vary their move order and depths
+        self.helper_id = helper_id
+        # Plies without a capture after which a line is scored as a draw
+        self.draw_plies = NO_CAPTURE_PLIES
+
+    def run(self, position, max_depth=64, time_limit=None, max_nodes=None, count=1):
+        """Search position until max_depth, time_limit seconds or max_nodes
+        nodes, whichever comes first.
+
+        Returns (move, score, depth) from the deepest finished iteration.
+        With count > 1 the best count moves all get exact scores, and
+        self.lines holds them as (move, score) pairs, best first.
+        """
+        position = position.copy()  # A timeout can leave moves unmade
+        self.nodes = self.tt_probes = self.tt_hits = 0
+        self.tt_cutoffs = self.cutoffs = 0
+        self.times = {'generation': 0.0, 'evaluation': 0.0}
+        if self.timing:
+            self.generate, self.evaluate = self.timed_moves, self.timed_evaluate
+        else:
+            self.generate, self.evaluate = ordered_moves, self.static_eval
+        self.deadline = None if time_limit is None else time.perf_counter() + time_limit
+        self.max_nodes = max_nodes
+        if self.owns_tt:
+            self.tt.new_search()
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = new_history()
+
+        moves = list(ordered_moves(position))
+        self.lines = []
+        if not moves:
+            return None, -WIN, 0
+
+        first_depth = 1
+        if self.helper_id:
+            random.Random(self.helper_id).shuffle(moves)
+            first_depth += self.helper_id % 2
+
+        best = (moves[0], 0, 0)
+        # An exact result for this position from an earlier search (or
+        # from pondering) stands in for the iterations it covers
+        entry = self.tt.probe(position.key) if count == 1 else None
+        if entry is not None and entry[1] == EXACT and entry[3] in moves:
+            depth, _, score, move = entry
+            best = (move, score_from_tt(score, 0), depth)
+            moves.remove(move)
+            moves.insert(0, move)
+            first_depth = max(first_depth, depth + 1)
+            self.lines = [best[:2]]
+            if first_depth > max_depth:
+                return best
+        for depth in range(first_depth, max_depth + 1):
+            try:
+                lines = self.search_root(position, moves, depth, count)
+            except SearchTimeout:
+                break
+            move, score = lines[0]
+            best = (move, score, depth)
+            self.lines = lines[:count]
+            # Search the best moves first on the next iteration
+            for move, _ in reversed(self.lines):
+                moves.remove(move)
+                moves.insert(0, move)
+            if abs(score) >= WIN - depth:
+                break  # Forced win or loss found
+        return best
+
+    def search_root(self, position, moves, depth, count=1):
+        """(move, score) for every root move, best first. Only the
+        best count scores are exact: every other move is searched
+        against the count-th best score so far and may only get a
+        bound, which keeps several lines nearly as cheap as one."""
+        lines = []
+        alpha = -WIN - 1
+        for move in moves:
+            position.make(move)
+            score = -self.negamax(position, depth - 1, -WIN - 1, -alpha, 1)
+            position.unmake()
+            lines.append((move, score))
+            if score > alpha:
+                if count == 1:
+                    alpha = score
+                elif len(lines) >= count:
+                    alpha = sorted(s for _, s in lines)[-count]
+        # Stable, so equal scores keep the search order
+        lines.sort(key=lambda line: -line[1])
+        return lines
+
+    def principal_variation(self, position, move, length=MAX_PLY):
+        """move followed by the best replies stored in the table"""
+        position = position.copy()
+        line = []
+        # Stored moves are checked, as a key collision can bring up
+        # one from another position, and a cycle ends the line
+        while move is not None and len(line) < length and is_legal(position, move):
+            line.append(move)
+            position.make(move)
+            if position.repetitions() > 1:
+                break
+            entry = self.tt.probe(position.key)
+            move = None if entry is None else entry[3]
+        return line
+
+    def negamax(self, position, depth, alpha, beta, ply):
+        self.nodes += 1
+        # Node budgets are checked exactly, so they give the same
+        # search every time
+        if self.nodes % CHECK_EVERY == 0 or self.nodes == self.max_nodes:
+            self.check_budget()
+
+        if position.is_lost():
+            return -WIN + ply
+        # A position seen before on the way here (or earlier in the game)
+        # is scored as a draw, so cycles are cut off instead of searched
+        if ply and (position.repetitions() > 1 or position.quiet_plies >= self.draw_plies):
+            return 0
+        if self.tablebase is not None:
+            value = self.tablebase.probe(position)
+            if value is not None:
+                return tablebase_score(value, ply)
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.evaluate(position)
+
+        key = position.key
+        hash_move = None
+        entry = self.tt.probe(key)
+        self.tt_probes += 1
+        if entry is not None:
+            self.tt_hits += 1
+            entry_depth, flag, score, hash_move = entry
+            if entry_depth >= depth:
+                score = score_from_tt(score, ply)
+                if flag == EXACT:
+                    self.tt_cutoffs += 1
+                    return score
+                if flag == LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    self.tt_cutoffs += 1
+                    return score
+
+        killers = self.killers[ply]
+        alpha_orig = alpha
+        best = -WIN + ply  # No legal move loses
+        best_move = None
+        for move in self.generate(position, hash_move, killers, self.history):
+            position.make(move)
+            score = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            position.unmake()
+            if score > best:
+                best = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        if move[2] is None:
+                            self.record_cutoff(position, move, killers, depth)
+                        break
+
+        if best <= alpha_orig:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt.store(key, depth, flag, score_to_tt(best, ply), best_move)
+        return best
+
+    def record_cutoff(self, position, move, killers, depth):
+        """Remember a quiet move that refuted a line"""
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[position.turn][history_index(move)] += depth * depth
+
+    def timed_moves(self, *args):
+        """ordered_moves, adding the time spent in it to self.times"""
+        moves = ordered_moves(*args)
+        times = self.times
+        while True:
+            started = time.perf_counter()
+            move = next(moves, None)
+            times['generation'] += time.perf_counter() - started
+            if move is None:
+                return
+            yield move
+
+    def timed_evaluate(self, position):
+        started = time.perf_counter()
+        score = self.static_eval(position)
+        self.times['evaluation'] += time.perf_counter() - started
+        return score
+
+    def stats(self):
+        """Counters of the last run"""
+        return {
+            'nodes': self.nodes,
+            'tt_probes': self.tt_probes,
+            'tt_hits': self.tt_hits,
+            'tt_hit_rate': self.tt_hits / self.tt_probes if self.tt_probes else 0.0,
+            'tt_cutoffs': self.tt_cutoffs,
+            'cutoffs': self.cutoffs,
+        }
+
+    def check_budget(self):
+        if self.stop is not None and self.stop.is_set():
+            raise SearchTimeout
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchTimeout
+
+def score_to_tt(score, ply):
+    """Store win/loss scores relative to the node rather than the root"""
+    if score >= WIN - 1000:
+        return score + ply
+    if score <= -WIN + 1000:
+        return score - ply
+    return score
+
+def score_from_tt(score, ply):
+    if score >= WIN - 1000:
+        return score - ply
+    if score <= -WIN + 1000:
+        return score + ply
+    return score
+
+def tablebase_score(value, ply):
+    """Search score for a tablebase value found ply moves from the root"""
+    if value == DRAW:
+        return 0
+    distance = value - 1
+    if distance % 2:
+        return WIN - ply - distance
+    return -WIN + ply + distance
@@ -0,0 +1,287 @@
+"""Asyncio server hosting many games at once.
+
+    python server.py --port 8765 --workers 4
+    python server.py --stdio
+
+The protocol is JSON lines: every request is one object on a line and
+gets exactly one reply line. Each connection is a session with its own
+game and AI settings:
+
+    {"cmd": "new", "difficulty": 5, "time_limit": 0.5, "ai": "2"}
+    {"cmd": "move", "move": [null, 4, null]}    the AI then answers
+    {"cmd": "go"}                               the AI moves now
+    {"cmd": "legal"}  {"cmd": "state"}  {"cmd": "quit"}
+
+Replies have "ok" and either the game state or an "error"; an "id" in
+a request is copied to its reply. Searches run in a bounded process
+pool so the event loop never blocks. At most --queue
+searches are handed to the pool at a time and a session waits for a
+slot before its next line is read. Sessions idle for --idle seconds
+are closed. With --record every finished game is appended to a record
+file (see records.py).
+"""
+import argparse
+import asyncio
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from helper import Position, PLAYERS, MAX_PIECES
+from game import Game
+from ai import MorrisAI
+from records import GameRecord, RecordWriter
+
+# Extra seconds a search may take beyond its limit before it is reported
+GRACE = 2.0
+
+# Per-process state of pool workers
+_engines = {}
+_options = {}
+
+def _init_worker(tablebase_dir, book_path):
+    _options.update(tablebase_dir=tablebase_dir, book_path=book_path)
+
+def think(pieces, moves, difficulty, time_limit):
+    """Pool task: the (src, dst, cap) move of the side to move after
+    moves; replaying them gives the search the game's history for
+    repetitions and the no-capture limit"""
+    position = Position(pieces)
+    for move in moves:
+        position.make(move)
+    player = PLAYERS[position.turn]
+    # Engines are reused across sessions to keep their tables warm
+    ai = _engines.get((difficulty, player))
+    if ai is None:
+        ai = MorrisAI(difficulty, position=position, player=player, **_options)
+        _engines[difficulty, player] = ai
+    ai.position = position
+    return ai.choose_move(time_limit)
+
+def parse_move(value):
+    """JSON [src, dst, cap] -> (src, dst, cap) tuple"""
+    if not isinstance(value, list) or len(value) != 3:
+        raise ValueError('a move is [src, dst, cap]')
+    for square in value:
+        if square is not None and (type(square) is not int or not 0 <= square < 24):
+            raise ValueError(f'bad point {square!r}')
+    return tuple(value)
+
+class Session:
+    """One client's game and AI settings"""
+    def __init__(self, server):
+        self.server = server
+        self.game = None
+        self.difficulty = 3
+        self.time_limit = 1.0
+        self.ai_player = '2'
+
+    async def handle(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('a request is a JSON object')
+        except ValueError as e:
+            return {'ok': False, 'error': f'bad request: {e}'}
+        try:
+            reply = await self.dispatch(request)
+        except (ValueError, TypeError) as e:
+            reply = {'ok': False, 'error': str(e)}
+        if 'id' in request:
+            reply['id'] = request['id']
+        return reply
+
+    async def dispatch(self, request):
+        cmd = request.get('cmd')
+        if cmd == 'new':
+            return await self.new_game(request)
+        if cmd == 'quit':
+            return {'ok': True, 'closed': True}
+        if self.game is None:
+            raise ValueError('no game; send {"cmd": "new"} first')
+        if cmd == 'state':
+            return self.state()
+        if cmd == 'legal':
+            return {'ok': True, 'moves': self.game.legal_moves()}
+        if cmd == 'move':
+            if self.game.over:
+                raise ValueError('the game is over')
+            self.game.play(parse_move(request.get('move')))
+            return self.finished(await self.answer())
+        if cmd == 'go':
+            if self.game.over:
+                raise ValueError('the game is over')
+            return self.finished(await self.ai_move())
+        raise ValueError(f'unknown command {cmd!r}')
+
+    async def new_game(self, request):
+        pieces = int(request.get('pieces', 9))
+        difficulty = int(request.get('difficulty', self.difficulty))
+        time_limit = float(request.get('time_limit', self.time_limit))
+        ai_player = request.get('ai', self.ai_player)
+        if not 3 <= pieces <= MAX_PIECES:
+            raise ValueError(f'pieces must be between 3 and {MAX_PIECES}')
+        if not 1 <= difficulty <= 5:
+            raise ValueError('difficulty must be between 1 and 5')
+        if ai_player not in PLAYERS and ai_player is not None:
+            raise ValueError('ai must be "1", "2" or null')
+        self.difficulty = difficulty
+        self.time_limit = min(max(time_limit, 0.01), self.server.max_time)
+        self.ai_player = ai_player
+        self.game = Game(pieces, self.server.max_plies)
+        return await self.answer()
+
+    async def answer(self):
+        """Let the AI reply if it is its turn"""
+        if not self.game.over and self.game.current_player == self.ai_player:
+            return await self.ai_move()
+        return self.state()
+
+    async def ai_move(self):
+        game = self.game
+        move = await self.server.search(game, self.difficulty, self.time_limit)
+        if move is None:
+            game.finish(PLAYERS[game.position.turn ^ 1],
+                        f'player {game.current_player} cannot move')
+        else:
+            game.play(move)
+        return dict(self.state(), ai_move=move)
+
+    def finished(self, reply):
+        """Record the game if the last command ended it"""
+        if self.game.over:
+            self.server.record(GameRecord.from_game(
+                self.game, ai=self.ai_player, difficulty=self.difficulty))
+        return reply
+
+    def state(self):
+        game = self.game
+        return {'ok': True, 'position': game.position.to_text(), 'to_move': game.current_player,
+                'phase': game.phase, 'plies': len(game.moves), 'over': game.over,
+                'winner': game.winner, 'reason': game.reason}
+
+class Server:
+    def __init__(self, workers=None, queue=64, max_sessions=1000, idle=300,
+                 max_time=5.0, max_plies=1000, tablebase_dir=None, book_path=None,
+                 record_path=None):
+        self.pool = ProcessPoolExecutor(workers, initializer=_init_worker,
+                                        initargs=(tablebase_dir, book_path))
+        self.slots = asyncio.Semaphore(queue)
+        self.max_sessions = max_sessions
+        self.idle = idle
+        self.max_time = max_time
+        self.max_plies = max_plies
+        self.sessions = 0
+        self.records = None if record_path is None else RecordWriter(record_path)
+
+    def record(self, record):
+        if self.records is not None:
+            self.records.write(record)
+
+    async def search(self, game, difficulty, time_limit):
+        """Run think() for game in the pool once a slot is free"""
+        loop = asyncio.get_running_loop()
+        await self.slots.acquire()
+        try:
+            job = self.pool.submit(think, game.pieces, game.moves, difficulty, time_limit)
+        except BaseException:
+            self.slots.release()
+            raise
+        # The slot is freed when the worker is done with the search, not
+        # when we stop waiting, so overrunning searches still count
+        # against --queue
+        job.add_done_callback(lambda _: release_soon(loop, self.slots))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job), time_limit + GRACE)
+        except asyncio.TimeoutError:
+            raise ValueError('search timed out') from None
+
+    async def serve_session(self, reader, writer):
+        if self.sessions >= self.max_sessions:
+            await send(writer, {'ok': False, 'error': 'server full', 'closed': True})
+            writer.close()
+            return
+        self.sessions += 1
+        session = Session(self)
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.idle)
+                except asyncio.TimeoutError:
+                    await send(writer, {'ok': False, 'error': 'idle timeout', 'closed': True})
+                    break
+                except ValueError:
+                    await send(writer, {'ok': False, 'error': 'line too long', 'closed': True})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                reply = await session.handle(line)
+                await send(writer, reply)
+                if reply.get('closed'):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            writer.close()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+        if self.records is not None:
+            self.records.close()
+
+def release_soon(loop, semaphore):
+    """Release semaphore from a pool thread"""
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        pass  # The loop has closed; nothing waits for the slot
+
+async def send(writer, reply):
+    writer.write(json.dumps(reply).encode() + b'\n')
+    await writer.drain()  # Wait while a slow client's buffer is full
+
+async def open_stdio():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,
+                                                        sys.stdout)
+    return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+async def serve(args):
+    server = Server(args.workers, args.queue, args.max_sessions, args.idle,
+                    args.max_time, args.max_plies, args.tablebase_dir, args.book,
+                    args.record)
+    try:
+        if args.stdio:
+            await server.serve_session(*await open_stdio())
+        else:
+            listener = await asyncio.start_server(server.serve_session, args.host, args.port)
+            async with listener:
+                await listener.serve_forever()
+    finally:
+        server.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve Nine Men\'s Morris games over JSON lines')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--stdio', action='store_true', help='one session on stdin/stdout')
+    parser.add_argument('--workers', type=int, default=None, help='search processes (default: all cores)')
+    parser.add_argument('--queue', type=int, default=64, help='searches handed to the pool at once')
+    parser.add_argument('--max-sessions', type=int, default=1000)
+    parser.add_argument('--idle', type=float, default=300, help='seconds before an idle session is closed')
+    parser.add_argument('--max-time', type=float, default=5.0, help='longest search a session may ask for')
+    parser.add_argument('--max-plies', type=int, default=1000, help='plies before a game is drawn')
+    parser.add_argument('--tablebase-dir')
+    parser.add_argument('--book')
+    parser.add_argument('--record', help='append finished games to this record file (.bin: binary)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""The 16 symmetries of the board and canonical position keys.
+
+Every point lies on one of three rings, numbered clockwise from a
+corner. Rotating by a quarter turn, reflecting, and swapping the inner
+and outer rings all map mills to mills and neighbours to neighbours;
+together they give 4 * 2 * 2 = 16 transforms.
+"""
+from helper import connections, mills
+
+# Points of the outer, middle and inner ring, clockwise from a corner
+RINGS = (
+    (0, 1, 2, 14, 23, 22, 21, 9),
+    (3, 4, 5, 13, 20, 19, 18, 10),
+    (6, 7, 8, 12, 17, 16, 15, 11),
+)
+
+def _build_transforms():
+    coords = {sq: (r, i) for r, ring in enumerate(RINGS) for i, sq in enumerate(ring)}
+    transforms = []
+    for swap in (False, True):
+        for reflect in (False, True):
+            for rotation in range(4):
+                perm = [0] * 24
+                for sq, (r, i) in coords.items():
+                    if swap:
+                        r = 2 - r
+                    if reflect:
+                        i = -i
+                    perm[sq] = RINGS[r][(i + 2 * rotation) % 8]
+                transforms.append(tuple(perm))
+    return transforms
+
+# TRANSFORMS[t][sq] is where point sq goes under transform t; 0 is the identity
+TRANSFORMS = _build_transforms()
+INVERSE = [TRANSFORMS.index(tuple(perm.index(sq) for sq in range(24)))
+           for perm in TRANSFORMS]
+
+_mill_sets = {frozenset(mill) for mill in mills}
+for _perm in TRANSFORMS:
+    assert {frozenset(_perm[p] for p in mill) for mill in mills} == _mill_sets
+    assert all(sorted(_perm[n] for n in connections[sq])
+               == sorted(connections[_perm[sq]]) for sq in range(24))
+
+# Per-byte lookup tables so a whole bitboard maps in three steps
+_BYTE_TABLES = [
+    [[sum(1 << perm[8 * part + bit] for bit in range(8) if value >> bit & 1)
+      for value in range(256)] for part in range(3)]
+    for perm in TRANSFORMS
+]
+
+def transform_bits(bits, t):
+    """Apply transform t to a 24-bit board mask"""
+    low, mid, high = _BYTE_TABLES[t]
+    return low[bits & 0xFF] | mid[bits >> 8 & 0xFF] | high[bits >> 16]
+
+def transform_move(move, t):
+    """Apply transform t to a (src, dst, cap) move"""
+    perm = TRANSFORMS[t]
+    src, dst, cap = move
+    return (None if src is None else perm[src], perm[dst],
+            None if cap is None else perm[cap])
+
+def canonical_bits(own, theirs):
+    """Smallest (own, theirs) image under the 16 transforms, and the
+    transform that produces it"""
+    best = None
+    best_t = 0
+    for t in range(16):
+        image = (transform_bits(own, t), transform_bits(theirs, t))
+        if best is None or image < best:
+            best = image
+            best_t = t
+    return best, best_t
+
+def canonical(position):
+    """Key identifying position and all its mirror images, plus the
+    transform mapping position onto the canonical representative.
+
+    The key packs both bitboards, pieces in hand and side to move into
+    one integer, so it is exact and fits in 64 bits.
+    """
+    (first, second), t = canonical_bits(position.bits[0], position.bits[1])
+    key = (first | second << 24
+           | position.in_hand[0] << 48 | position.in_hand[1] << 52
+           | position.turn << 56)
+    return key, t
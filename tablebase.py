@@ -0,0 +1,358 @@
+"""Endgame tablebases solved by retrograde analysis.
+
+A table covers every position with no pieces left in hand where the
+side to move has a pieces and the opponent b (written "avb"). Each
+position takes one byte: 0 for a draw, otherwise the distance to the
+end of the game in plies plus one. An odd distance is a win for the
+side to move, an even one a loss.
+
+Positions are stored once per symmetry class (see symmetry.py): the
+side to move's pieces are reduced to a canonical set, which makes the
+files and the solving work about 16 times smaller.
+
+Build tables with:
+
+    python tablebase.py 3v3 4v3 3v4 --out tablebases
+
+and probe them from the search with Tablebase(directory).
+"""
+import argparse
+import math
+import mmap
+import os
+import struct
+import time
+from array import array
+from itertools import combinations
+from helper import ADJACENT_MASKS, MILLS_BY_SQUARE, FULL, squares
+from symmetry import canonical_bits, transform_bits
+
+MAGIC = b'NMMTB'
+VERSION = 2
+HEADER = struct.Struct('<5sBBBI')
+
+DRAW = 0
+MAX_DISTANCE = 253
+
+BINOMIAL = [[math.comb(n, k) for k in range(25)] for n in range(25)]
+
+def table_name(a, b):
+    return f'tb_{a}v{b}.bin'
+
+def table_size(a, b):
+    return len(canonical_sets(a)) * BINOMIAL[24 - a][b]
+
+def subset_rank(mask):
+    """Rank of a set of points in the combinatorial number system"""
+    rank = 0
+    for i, sq in enumerate(squares(mask)):
+        rank += BINOMIAL[sq][i + 1]
+    return rank
+
+def subsets(n, k):
+    """Masks of every k-point subset of range(n), in rank order"""
+    masks = [sum(1 << i for i in combo) for combo in combinations(range(n), k)]
+    masks.sort(key=subset_rank)
+    return masks
+
+def compress(mask, holes):
+    """Renumber the points of mask as if the points in holes were absent"""
+    out = 0
+    for sq in squares(mask):
+        out |= 1 << (sq - (holes & ((1 << sq) - 1)).bit_count())
+    return out
+
+def uncompress(mask, holes):
+    """Inverse of compress"""
+    free = [sq for sq in range(24) if not holes >> sq & 1]
+    out = 0
+    for i in squares(mask):
+        out |= 1 << free[i]
+    return out
+
+def index(own, theirs, b):
+    """Slot of a position in the table for its piece counts; every
+    mirror image of a position shares one slot"""
+    (own, theirs), _ = canonical_bits(own, theirs)
+    a = own.bit_count()
+    return (canonical_ranks(a)[own] * BINOMIAL[24 - a][b]
+            + ranks(24 - a, b)[compress(theirs, own)])
+
+def closes_mill(bits, sq):
+    for mask in MILLS_BY_SQUARE[sq]:
+        if bits & mask == mask:
+            return True
+    return False
+
+def removable(bits):
+    """Capturable points of bits: outside mills, or all if none are"""
+    free = [sq for sq in squares(bits) if not closes_mill(bits, sq)]
+    return free or list(squares(bits))
+
+def steps(own, empty):
+    """(src, dst) moves for a side with no pieces in hand"""
+    if own.bit_count() == 3:
+        targets = list(squares(empty))
+        return [(src, dst) for src in squares(own) for dst in targets]
+    return [(src, dst) for src in squares(own)
+            for dst in squares(ADJACENT_MASKS[src] & empty)]
+
+def is_win(value):
+    return value != DRAW and value % 2 == 0
+
+def is_loss(value):
+    return value != DRAW and value % 2 == 1
+
+class Solver:
+    """Retrograde solver writing one file per table into directory"""
+    def __init__(self, directory, verbose=True):
+        self.directory = directory
+        self.verbose = verbose
+        self.solved = {}
+
+    def log(self, message):
+        if self.verbose:
+            print(message, flush=True)
+
+    def load(self, a, b):
+        """Values of a finished table, solving it first if needed"""
+        if (a, b) not in self.solved:
+            path = os.path.join(self.directory, table_name(a, b))
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(HEADER.size)
+                    self.solved[(a, b)] = f.read()
+            else:
+                self.solve(a, b)
+        return self.solved[(a, b)]
+
+    def solve(self, a, b):
+        """Solve a v b together with b v a, which it moves into"""
+        pair = [(a, b)] if a == b else [(a, b), (b, a)]
+        # Captures lead into smaller tables, which must be solved first
+        lower = {}
+        for x, y in pair:
+            if y - 1 >= 3:
+                lower[(x, y)] = self.load(y - 1, x)
+
+        started = time.perf_counter()
+        offsets = {}
+        total = 0
+        for key in pair:
+            offsets[key] = total
+            total += table_size(*key)
+        self.log(f'Solving {" + ".join("%dv%d" % key for key in pair)}: {total} positions')
+
+        values = bytearray(total)
+        counts = array('H', [0]) * total
+        # Positions settled at each distance, and positions with a capture
+        # into a smaller table that the opponent loses or wins from there
+        resolved = [array('I') for _ in range(MAX_DISTANCE + 2)]
+        lost_after = [array('I') for _ in range(MAX_DISTANCE + 2)]
+        won_after = [array('I') for _ in range(MAX_DISTANCE + 2)]
+
+        # Forward pass: count successor classes and note the results of
+        # captures. Counting classes rather than moves keeps the counts in
+        # step with parents(), which also yields each class once.
+        for (x, y), offset in offsets.items():
+            below = lower.get((x, y))
+            theirs_size = BINOMIAL[24 - x][y]
+            their_sets = subsets_cache(24 - x, y)
+            mirror = offsets[(y, x)]
+            for r, own in enumerate(canonical_sets(x)):
+                base = offset + r * theirs_size
+                for s, packed in enumerate(their_sets):
+                    node = base + s
+                    theirs = uncompress(packed, own)
+                    if offset + index(own, theirs, y) != node:
+                        continue  # Mirror image of another slot
+                    empty = FULL & ~(own | theirs)
+                    children = set()
+                    captured = set()
+                    targets = None
+                    for src, dst in steps(own, empty):
+                        after = own ^ (1 << src) | 1 << dst
+                        if not closes_mill(after, dst):
+                            children.add(mirror + index(theirs, after, x))
+                            continue
+                        if targets is None:
+                            targets = removable(theirs)
+                        for cap in targets:
+                            if below is None:
+                                # Opponent is left with two pieces
+                                captured.add(-1)
+                            else:
+                                captured.add(index(theirs & ~(1 << cap), after, x))
+                    for child in captured:
+                        if child == -1:
+                            lost_after[0].append(node)
+                            continue
+                        value = below[child]
+                        if is_loss(value):
+                            lost_after[value - 1].append(node)
+                        elif is_win(value):
+                            won_after[value - 1].append(node)
+                    count = len(children) + len(captured)
+                    if count == 0:
+                        values[node] = 1  # Blocked: lost on the spot
+                        resolved[0].append(node)
+                    else:
+                        counts[node] = count
+
+        # Backward pass, one distance at a time
+        for distance in range(MAX_DISTANCE + 1):
+            nxt = distance + 1
+            for node in lost_after[distance]:
+                if values[node] == DRAW:
+                    values[node] = nxt + 1
+                    resolved[nxt].append(node)
+            for node in won_after[distance]:
+                if values[node] == DRAW:
+                    counts[node] -= 1
+                    if counts[node] == 0:
+                        values[node] = nxt + 1
+                        resolved[nxt].append(node)
+            for node in resolved[distance]:
+                lost = is_loss(values[node])
+                for parent in self.parents(node, offsets):
+                    if values[parent] != DRAW:
+                        continue
+                    if lost:
+                        values[parent] = nxt + 1
+                        resolved[nxt].append(parent)
+                    else:
+                        counts[parent] -= 1
+                        if counts[parent] == 0:
+                            values[parent] = nxt + 1
+                            resolved[nxt].append(parent)
+            resolved[distance] = lost_after[distance] = won_after[distance] = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        for key, offset in offsets.items():
+            data = bytes(values[offset:offset + table_size(*key)])
+            self.solved[key] = data
+            with open(os.path.join(self.directory, table_name(*key)), 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, key[0], key[1], len(data)))
+                f.write(data)
+            wins = sum(1 for v in data if is_win(v))
+            draws = data.count(DRAW)
+            self.log(f'  {key[0]}v{key[1]}: {wins} wins, {len(data) - wins - draws} losses, '
+                     f'{draws} draws or unused mirror slots')
+        self.log(f'  done in {time.perf_counter() - started:.1f}s')
+
+    def parents(self, node, offsets):
+        """Position classes with a non-capturing move into node's class"""
+        for (x, y), offset in offsets.items():
+            if node - offset < table_size(x, y):
+                break
+        r, s = divmod(node - offset, BINOMIAL[24 - x][y])
+        own = canonical_sets(x)[r]
+        theirs = uncompress(subsets_cache(24 - x, y)[s], own)
+        # The opponent just moved one of theirs without closing a mill
+        parent_offset = offsets[(y, x)]
+        empty = FULL & ~(own | theirs)
+        flying = y == 3
+        found = set()
+        for dst in squares(theirs):
+            if closes_mill(theirs, dst):
+                continue
+            origins = empty if flying else ADJACENT_MASKS[dst] & empty
+            for src in squares(origins):
+                before = theirs ^ (1 << dst) | 1 << src
+                found.add(parent_offset + index(before, own, x))
+        return found
+
+_subsets = {}
+_ranks = {}
+
+def subsets_cache(n, k):
+    if (n, k) not in _subsets:
+        _subsets[(n, k)] = subsets(n, k)
+    return _subsets[(n, k)]
+
+def ranks(n, k):
+    """Mask to rank lookup for the k-point subsets of range(n)"""
+    if (n, k) not in _ranks:
+        _ranks[(n, k)] = {mask: i for i, mask in enumerate(subsets_cache(n, k))}
+    return _ranks[(n, k)]
+
+_canonical_sets = {}
+_canonical_ranks = {}
+
+def canonical_sets(k):
+    """Smallest member of each symmetry class of k-point sets, sorted"""
+    if k not in _canonical_sets:
+        _canonical_sets[k] = sorted({min(transform_bits(mask, t) for t in range(16))
+                                     for mask in subsets_cache(24, k)})
+    return _canonical_sets[k]
+
+def canonical_ranks(k):
+    if k not in _canonical_ranks:
+        _canonical_ranks[k] = {mask: i for i, mask in enumerate(canonical_sets(k))}
+    return _canonical_ranks[k]
+
+class Tablebase:
+    """Read-only, memory-mapped access to solved tables.
+
+    Files are mapped rather than read, so every process probing the
+    same directory shares a single copy of the pages.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.max_pieces = 0
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.startswith('tb_') and name.endswith('.bin'):
+                    a, b = name[3:-4].split('v')
+                    self.max_pieces = max(self.max_pieces, int(a), int(b))
+
+    def table(self, a, b):
+        if (a, b) not in self.tables:
+            path = os.path.join(self.directory, table_name(a, b))
+            table = None
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, x, y, size = HEADER.unpack_from(table)
+                if magic != MAGIC or version != VERSION or (x, y) != (a, b):
+                    raise ValueError(f'{path} is not a version {VERSION} {a}v{b} table')
+            self.tables[(a, b)] = table
+        return self.tables[(a, b)]
+
+    def probe(self, position):
+        """Raw table value for position, or None if no table covers it"""
+        if position.in_hand[0] or position.in_hand[1]:
+            return None
+        own = position.bits[position.turn]
+        theirs = position.bits[position.turn ^ 1]
+        a = own.bit_count()
+        b = theirs.bit_count()
+        if a < 3 or b < 3 or a > self.max_pieces or b > self.max_pieces:
+            return None
+        table = self.table(a, b)
+        if table is None:
+            return None
+        return table[HEADER.size + index(own, theirs, b)]
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables.clear()
+
+def main():
+    parser = argparse.ArgumentParser(description='Build endgame tablebases')
+    parser.add_argument('tables', nargs='+', help="tables to build, e.g. 3v3 4v3")
+    parser.add_argument('--out', default='tablebases', help='output directory')
+    args = parser.parse_args()
+
+    solver = Solver(args.out)
+    for spec in args.tables:
+        a, b = (int(n) for n in spec.split('v'))
+        if a < 3 or b < 3 or a + b > 18:
+            parser.error(f'{spec}: each side needs 3 to 9 pieces')
+        solver.load(a, b)
+
+if __name__ == '__main__':
+    main()
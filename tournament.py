@@ -0,0 +1,157 @@
+"""Engine-vs-engine matches spread over a process pool.
+
+    python tournament.py "difficulty=5,time_limit=0.1" "difficulty=3" \\
+        --games 1000 --workers 8 --max-plies 300
+
+Each engine is a comma-separated list of MorrisAI options. Every pair
+of engines plays the given number of games with colours alternating;
+the report gives wins/draws/losses, an Elo difference with the bounds
+of its 95% interval, and games per second.
+"""
+import argparse
+import json
+import math
+import time
+from multiprocessing import Pool
+from game import AIPlayer, play_game
+from records import GameRecord, RecordWriter
+
+def parse_engine(spec):
+    """'difficulty=5,time_limit=0.1' -> {'difficulty': 5, 'time_limit': 0.1}"""
+    options = {}
+    for item in filter(None, spec.split(',')):
+        name, value = item.split('=', 1)
+        for convert in (int, float):
+            try:
+                value = convert(value)
+                break
+            except ValueError:
+                pass
+        options[name.strip()] = value
+    return options
+
+def check_engine(options):
+    """Raise ValueError for options a pool worker cannot run: pool
+    workers are daemonic and cannot start the processes of a parallel
+    search"""
+    if options.get('workers', 1) > 1:
+        raise ValueError(f'{options}: workers > 1 cannot run inside a worker process')
+
+def play_match_game(job):
+    """Worker: one game; returns the pair, the score for the pair's
+    first engine, the number of plies and the game record"""
+    pair, first, second, swapped, seed, max_plies = job
+    if swapped:
+        first, second = second, first
+    # Seeded engines make every game replayable (with node budgets)
+    game = play_game(AIPlayer(**dict({'seed': 2 * seed}, **first)),
+                     AIPlayer(**dict({'seed': 2 * seed + 1}, **second)), max_plies=max_plies)
+    if game.winner is None:
+        score = 0.5
+    else:
+        score = 1.0 if (game.winner == '1') != swapped else 0.0
+    record = GameRecord.from_game(game, players=[first, second], seed=seed)
+    return pair, score, len(game.moves), record
+
+def elo(wins, draws, losses):
+    """Elo difference and the lower and upper bounds of its 95%
+    interval from a match result. The interval is Wilson's for the
+    score, which stays inside (0, 1) unless every game went one way;
+    an unbounded value (at a score of 0 or 100%) is None."""
+    games = wins + draws + losses
+    if games == 0:
+        return None, None, None
+    score = (wins + draws / 2) / games
+    z = 1.96
+    centre = (score + z * z / (2 * games)) / (1 + z * z / games)
+    half = z / (1 + z * z / games) * math.sqrt(score * (1 - score) / games
+                                               + z * z / (4 * games * games))
+
+    def to_elo(s):
+        return -400 * math.log10(1 / s - 1) + 0.0  # No -0.0
+
+    if score == 0:
+        return None, None, to_elo(centre + half)
+    if score == 1:
+        return None, to_elo(centre - half), None
+    return to_elo(score), to_elo(centre - half), to_elo(centre + half)
+
+def format_elo(value, unbounded):
+    return unbounded if value is None else f'{value:+.1f}'
+
+def run_tournament(engines, games=100, workers=None, max_plies=300, seed=0, record_path=None):
+    """Play every pair of engines; return a list of per-pair results.
+    With record_path every game is appended to that record file."""
+    for engine in engines:
+        check_engine(engine)
+    jobs = []
+    for i in range(len(engines)):
+        for j in range(i + 1, len(engines)):
+            for n in range(games):
+                jobs.append(((i, j), engines[i], engines[j], n % 2 == 1,
+                             seed * 1000003 + len(jobs), max_plies))
+
+    results = {}
+    writer = None if record_path is None else RecordWriter(record_path)
+    started = time.perf_counter()
+    with Pool(workers) as pool:
+        for pair, score, plies, record in pool.imap_unordered(play_match_game, jobs, chunksize=4):
+            if writer is not None:
+                writer.write(record)
+            tally = results.setdefault(pair, {'wins': 0, 'draws': 0, 'losses': 0, 'plies': 0})
+            tally['wins' if score == 1 else 'draws' if score == 0.5 else 'losses'] += 1
+            tally['plies'] += plies
+    elapsed = time.perf_counter() - started
+    if writer is not None:
+        writer.close()
+
+    report = []
+    for (i, j), tally in sorted(results.items()):
+        difference, low, high = elo(tally['wins'], tally['draws'], tally['losses'])
+        played = tally['wins'] + tally['draws'] + tally['losses']
+        report.append({
+            'engine': engines[i], 'opponent': engines[j],
+            'wins': tally['wins'], 'draws': tally['draws'], 'losses': tally['losses'],
+            'elo': None if difference is None else round(difference, 1),
+            'elo_low': None if low is None else round(low, 1),
+            'elo_high': None if high is None else round(high, 1),
+            'average_plies': round(tally['plies'] / played, 1),
+        })
+    return {'pairs': report, 'games': len(jobs), 'seconds': round(elapsed, 2),
+            'games_per_second': round(len(jobs) / elapsed, 2) if elapsed else None}
+
+def main():
+    parser = argparse.ArgumentParser(description='Play engine configurations against each other')
+    parser.add_argument('engines', nargs='+', help="MorrisAI options, e.g. 'difficulty=5,time_limit=0.1'")
+    parser.add_argument('--games', type=int, default=100, help='games per pair of engines')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--max-plies', type=int, default=300, help='plies before a game is drawn')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--record', help='append every game to this record file (.bin: binary)')
+    args = parser.parse_args()
+    if len(args.engines) < 2:
+        parser.error('need at least two engines')
+
+    engines = [parse_engine(spec) for spec in args.engines]
+    for engine in engines:
+        try:
+            check_engine(engine)
+        except ValueError as e:
+            parser.error(str(e))
+    result = run_tournament(engines, args.games, args.workers, args.max_plies, args.seed,
+                            args.record)
+    for pair in result['pairs']:
+        print(f"{pair['engine']} vs {pair['opponent']}: "
+              f"+{pair['wins']} ={pair['draws']} -{pair['losses']}, "
+              f"Elo {format_elo(pair['elo'], '-inf' if pair['wins'] == 0 else '+inf')} "
+              f"(95%: {format_elo(pair['elo_low'], '-inf')} "
+              f"to {format_elo(pair['elo_high'], '+inf')})")
+    print(f"{result['games']} games in {result['seconds']}s "
+          f"({result['games_per_second']} games/s)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+from helper import encode_move, decode_move
+
+# Bound types
+EXACT, LOWER, UPPER = 1, 2, 3
+
+# Layout of the data word of an entry
+_MOVE_BITS = 15
+_SCORE_SHIFT = 15  # 16 bits, stored with an offset of 1 << 15
+_DEPTH_SHIFT = 31  # 8 bits
+_FLAG_SHIFT = 39  # 2 bits
+_AGE_SHIFT = 41  # 8 bits
+
+ENTRY_BYTES = 16  # Key word plus data word
+BUCKET_BYTES = 2 * ENTRY_BYTES
+
+class TranspositionTable:
+    """Fixed-size transposition table packed into 64-bit words.
+
+    Each bucket holds two entries: a depth-preferred slot, overwritten
+    only by deeper searches or stale entries from earlier searches, and
+    an always-replace slot. Memory use is fixed at creation by size_mb.
+
+    The key word is stored XORed with the data word, so an entry torn
+    by two processes writing at once fails the key check instead of
+    returning mixed data. That lets several processes share one table
+    in a buffer such as multiprocessing.shared_memory (see parallel.py).
+    """
+    def __init__(self, size_mb=16, buffer=None):
+        buckets = table_buckets(size_mb)
+        self.mask = buckets - 1
+        if buffer is None:
+            buffer = bytearray(buckets * BUCKET_BYTES)
+        self.words = memoryview(buffer)[:buckets * BUCKET_BYTES].cast('Q')
+        self.age = 0
+
+    def new_search(self):
+        """Mark entries from earlier searches as replaceable"""
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        raw = self.words.cast('B')
+        raw[:] = bytes(len(raw))
+
+    def probe(self, key):
+        """Return (depth, flag, score, move) stored for key, or None"""
+        words = self.words
+        i = (key & self.mask) * 4
+        data = words[i + 1]
+        if data and words[i] ^ data == key:
+            return unpack(data)
+        data = words[i + 3]
+        if data and words[i + 2] ^ data == key:
+            return unpack(data)
+        return None
+
+    def store(self, key, depth, flag, score, move):
+        words = self.words
+        i = (key & self.mask) * 4
+        data = (encode_move(move) if move is not None else 0) \
+            | (score + (1 << 15)) << _SCORE_SHIFT \
+            | depth << _DEPTH_SHIFT \
+            | flag << _FLAG_SHIFT \
+            | self.age << _AGE_SHIFT
+        old = words[i + 1]
+        if (not old or words[i] ^ old == key
+                or depth >= old >> _DEPTH_SHIFT & 0xFF
+                or old >> _AGE_SHIFT != self.age):
+            words[i] = key ^ data
+            words[i + 1] = data
+        else:
+            words[i + 2] = key ^ data
+            words[i + 3] = data
+
+def table_buckets(size_mb):
+    """Largest power-of-two bucket count fitting in size_mb megabytes"""
+    buckets = 1
+    while (buckets * 2) * BUCKET_BYTES <= size_mb * (1 << 20):
+        buckets *= 2
+    return buckets
+
+def table_bytes(size_mb):
+    return table_buckets(size_mb) * BUCKET_BYTES
+
+def unpack(data):
+    code = data & ((1 << _MOVE_BITS) - 1)
+    return (data >> _DEPTH_SHIFT & 0xFF,
+            data >> _FLAG_SHIFT & 3,
+            (data >> _SCORE_SHIFT & 0xFFFF) - (1 << 15),
+            decode_move(code) if code else None)
@@ -0,0 +1,160 @@
+"""Fit the evaluation weights to game results (requires NumPy).
+
+    python tune.py games.bin more.txt --out weights.json
+
+Every position of every finished game in the record files (see
+records.py) is labelled with the game's result for the side to move:
+1 for a win, 0.5 for a draw, 0 for a loss. Positions are turned into
+feature differences in batches with batch_eval and cached next to each
+record file, so later runs skip the replay. The weights are then fitted
+by gradient descent on the mean squared error between the labels and
+sigmoid(scale * score), Texel style, and written as JSON for
+evaluate.load_weights; MorrisAI picks up weights.json at startup.
+
+Records are replayed without checking legality; run records.py check
+on files from outside sources first.
+"""
+import argparse
+import json
+import os
+from array import array
+import numpy as np
+from helper import Position
+from evaluate import WEIGHTS, WEIGHTS_FILE
+from batch_eval import FEATURES, batch_features
+from records import read_records
+
+CACHE_VERSION = 1
+
+# Game results as the score of player '1'
+OUTCOMES = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}
+
+def bits_to_boards(bits0, bits1):
+    """(N,) arrays of 24-bit masks -> (N, 24) boards of 0/1/2"""
+    shifts = np.arange(24, dtype=np.uint32)
+    return (((bits0[:, None] >> shifts) & 1) + 2 * ((bits1[:, None] >> shifts) & 1)).astype(np.int8)
+
+def batch_to_arrays(columns):
+    """Feature differences (N, F) for the side to move, and labels"""
+    bits0, bits1, hand0, hand1, turn, labels = (np.frombuffer(c, dtype=c.typecode)
+                                                for c in columns)
+    boards = bits_to_boards(bits0.astype(np.uint32), bits1.astype(np.uint32))
+    in_hand = np.stack([hand0, hand1], axis=1).astype(np.int16)
+    features = batch_features(boards, in_hand)
+    sign = np.where(turn == 0, 1, -1).astype(np.int16)
+    diff = np.stack([(features[name][:, 0] - features[name][:, 1]) * sign
+                     for name in FEATURES], axis=1).astype(np.int16)
+    return diff, labels.astype(np.float32)
+
+def extract(records, skip=0, batch_size=1 << 20):
+    """Yield (features, labels) batches for the positions of records,
+    leaving out the first skip plies of every game"""
+    columns = [array('I'), array('I'), array('B'), array('B'), array('B'), array('f')]
+    bits0, bits1, hand0, hand1, turn, labels = columns
+    for record in records:
+        outcome = OUTCOMES.get(record.result)
+        if outcome is None:
+            continue  # Unfinished game
+        position = Position(record.pieces)
+        for ply, move in enumerate(record.moves):
+            if ply >= skip:
+                bits0.append(position.bits[0])
+                bits1.append(position.bits[1])
+                hand0.append(position.in_hand[0])
+                hand1.append(position.in_hand[1])
+                turn.append(position.turn)
+                labels.append(outcome if position.turn == 0 else 1 - outcome)
+            position.make(move)
+        if len(labels) >= batch_size:
+            yield batch_to_arrays(columns)
+            for column in columns:
+                del column[:]
+    if labels:
+        yield batch_to_arrays(columns)
+
+def load_positions(path, skip=0):
+    """Features and labels of a record file, from its cache when the
+    cache matches the file and the settings"""
+    stat = os.stat(path)
+    key = [CACHE_VERSION, stat.st_size, int(stat.st_mtime), skip, list(FEATURES)]
+    cache = path + '.features.npz'
+    if os.path.exists(cache):
+        with np.load(cache) as data:
+            if json.loads(str(data['key'])) == key:
+                return data['features'], data['labels']
+    batches = list(extract(read_records(path), skip))
+    if batches:
+        features = np.concatenate([b[0] for b in batches])
+        labels = np.concatenate([b[1] for b in batches])
+    else:
+        features = np.zeros((0, len(FEATURES)), dtype=np.int16)
+        labels = np.zeros(0, dtype=np.float32)
+    with open(cache, 'wb') as f:
+        np.savez(f, key=json.dumps(key), features=features, labels=labels)
+    return features, labels
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+def loss(features, labels, weights, scale):
+    return float(np.mean((labels - sigmoid(scale * (features @ weights))) ** 2))
+
+def fit_scale(features, labels, weights):
+    """Scale that best maps scores with the given weights to results"""
+    best = None
+    for scale in np.geomspace(1e-4, 1, 81):
+        error = loss(features, labels, weights, scale)
+        if best is None or error < best[0]:
+            best = (error, scale)
+    return best[1]
+
+def fit(features, labels, weights=None, scale=None, iterations=3000, rate=0.05):
+    """Weights (dict) minimizing the Texel loss, by Adam over the full
+    batch; returns (weights, scale, loss before, loss after)"""
+    if weights is None:
+        weights = WEIGHTS
+    x = features.astype(np.float64)
+    y = labels.astype(np.float64)
+    w = np.array([weights[name] for name in FEATURES], dtype=np.float64)
+    if scale is None:
+        scale = fit_scale(x, y, w)
+    before = loss(x, y, w, scale)
+
+    m = np.zeros_like(w)
+    v = np.zeros_like(w)
+    for t in range(1, iterations + 1):
+        p = sigmoid(scale * (x @ w))
+        gradient = x.T @ ((p - y) * p * (1 - p)) * (2 * scale / len(y))
+        m = 0.9 * m + 0.1 * gradient
+        v = 0.999 * v + 0.001 * gradient ** 2
+        w -= rate * (m / (1 - 0.9 ** t)) / (np.sqrt(v / (1 - 0.999 ** t)) + 1e-12)
+
+    # The search works in integer scores
+    w = np.round(w)
+    fitted = {name: int(value) for name, value in zip(FEATURES, w)}
+    return fitted, scale, before, loss(x, y, w, scale)
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit evaluation weights to game results')
+    parser.add_argument('records', nargs='+', help='record files (text or .bin)')
+    parser.add_argument('--out', default=WEIGHTS_FILE, help='weights file to write')
+    parser.add_argument('--skip', type=int, default=0, help='opening plies to leave out of every game')
+    parser.add_argument('--iterations', type=int, default=3000)
+    parser.add_argument('--rate', type=float, default=0.05, help='Adam step size')
+    args = parser.parse_args()
+
+    loaded = [load_positions(path, args.skip) for path in args.records]
+    features = np.concatenate([f for f, _ in loaded])
+    labels = np.concatenate([l for _, l in loaded])
+    if not len(labels):
+        parser.error('no positions from finished games')
+    weights, scale, before, after = fit(features, labels, iterations=args.iterations,
+                                        rate=args.rate)
+    with open(args.out, 'w') as f:
+        json.dump({'weights': weights, 'scale': scale, 'positions': len(labels),
+                   'loss': after, 'initial_loss': before}, f, indent=2)
+    print(f'{len(labels)} positions, loss {before:.5f} -> {after:.5f}')
+    print(json.dumps(weights))
+
+if __name__ == '__main__':
+    main()
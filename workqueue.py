@@ -0,0 +1,597 @@
+"""Self-play and analysis jobs spread over many machines.
+
+    python workqueue.py selfplay "difficulty=5,time_limit=0.1" "difficulty=3" \\
+        --games 10000 --batch 20 --address 0.0.0.0:8766 --record games.bin
+    python workqueue.py analyse games.bin --difficulty 5 --spool /shared/spool
+    python workqueue.py work --address coordinator:8766 --processes 8
+
+The coordinator splits the work into jobs: batches of games, or of
+recorded games to analyse, each carrying its MorrisAI options. Workers
+lease one job at a time and renew the lease while they run it. A job
+whose lease runs out (its worker crashed or lost touch) goes back in
+the queue, up to max_attempts times. Every finished job is appended to
+a journal (JSON lines) and self-play games also to a record file; job
+ids are derived from the settings, so a restarted coordinator skips
+the jobs in its journal, and a second result for a job is dropped.
+
+Workers reach the coordinator through a transport with lease, renew,
+complete, fail and finished methods:
+
+    SocketClient    JSON lines over TCP ('host:port') or a Unix socket
+                    (a path), served by serve()
+    Spool           a shared directory; workers claim job files by
+                    renaming them and the coordinator pumps the spool
+    Coordinator     itself, for workers in the same process
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from records import GameRecord, RecordWriter, read_records, analyse_record
+from tournament import parse_engine, play_match_game, check_engine
+
+# Seconds a lease lasts without renewal; workers renew every third of it
+LEASE_SECONDS = 60.0
+
+# Leases of one job before it is given up
+MAX_ATTEMPTS = 3
+
+class Coordinator:
+    """Queue of jobs with leases, retries and a journal of results"""
+    def __init__(self, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 journal=None, record_path=None):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.jobs = {}
+        self.pending = deque()
+        self.leases = {}  # Job id -> (lease, worker, deadline)
+        self.done = set()
+        self.failed = {}  # Job id -> last error
+        self.given_up = {}  # Job id -> job out of attempts
+        self.retries = 0
+        self.duplicates = 0
+        self.lock = threading.Lock()  # serve() calls in from many threads
+        if journal is not None and os.path.exists(journal):
+            with open(journal) as f:
+                self.done.update(json.loads(line)['id'] for line in f if line.strip())
+        self.journal = None if journal is None else open(journal, 'a')
+        self.records = None if record_path is None else RecordWriter(record_path)
+
+    def submit(self, job):
+        """Queue a job dict with 'id', 'kind', 'options' and 'items';
+        a job already queued or finished is skipped"""
+        with self.lock:
+            if job['id'] in self.done or job['id'] in self.jobs:
+                return False
+            self.given_up.pop(job['id'], None)
+            self.jobs[job['id']] = dict(job, attempts=0)
+            self.pending.append(job['id'])
+            return True
+
+    def lease(self, worker):
+        """The next job for worker with its lease, or None"""
+        with self.lock:
+            self.expire()
+            if not self.pending:
+                return None
+            job_id = self.pending.popleft()
+            job = self.jobs[job_id]
+            job['attempts'] += 1
+            lease = uuid.uuid4().hex
+            self.leases[job_id] = (lease, worker, time.monotonic() + self.lease_seconds)
+            return dict(job, lease=lease, lease_seconds=self.lease_seconds)
+
+    def renew(self, job):
+        """Extend a lease; False once it has expired or the job is done"""
+        with self.lock:
+            held = self.leases.get(job['id'])
+            if held is None or held[0] != job['lease']:
+                return False
+            self.leases[job['id']] = (held[0], held[1], time.monotonic() + self.lease_seconds)
+            return True
+
+    def complete(self, job, result, worker=None):
+        """Store a job's result. Results are accepted from expired leases
+        and for jobs given up after them too, since the work is the same;
+        False for a duplicate."""
+        with self.lock:
+            job_id = job['id']
+            if job_id in self.done or (job_id not in self.jobs
+                                       and job_id not in self.given_up):
+                self.duplicates += 1
+                return False
+            self.done.add(job_id)
+            self.leases.pop(job_id, None)
+            if job_id in self.pending:
+                self.pending.remove(job_id)
+            self.failed.pop(job_id, None)
+            kind = (self.jobs.pop(job_id, None) or self.given_up.pop(job_id))['kind']
+            if self.records is not None:
+                for text in result.get('records', ()):
+                    self.records.write(GameRecord.from_text(text))
+            if self.journal is not None:
+                self.journal.write(json.dumps({'id': job_id, 'kind': kind, 'worker': worker,
+                                               'result': result}) + '\n')
+                self.journal.flush()
+            return True
+
+    def fail(self, job, error):
+        """Give up a lease after an error; the job is retried unless it
+        has used up its attempts"""
+        with self.lock:
+            held = self.leases.get(job['id'])
+            if held is None or held[0] != job['lease']:
+                return False
+            del self.leases[job['id']]
+            self.retry(job['id'], error)
+            return True
+
+    def expire(self):
+        """Requeue the jobs whose leases have run out"""
+        now = time.monotonic()
+        for job_id, (_, worker, deadline) in list(self.leases.items()):
+            if deadline < now:
+                del self.leases[job_id]
+                self.retry(job_id, f'lease held by {worker} expired')
+
+    def retry(self, job_id, error):
+        self.failed[job_id] = error
+        if self.jobs[job_id]['attempts'] < self.max_attempts:
+            self.retries += 1
+            self.pending.append(job_id)
+        else:
+            self.given_up[job_id] = self.jobs.pop(job_id)
+
+    def finished(self):
+        with self.lock:
+            self.expire()
+            return not self.pending and not self.leases
+
+    def stats(self):
+        with self.lock:
+            return {'done': len(self.done), 'pending': len(self.pending),
+                    'leased': len(self.leases),
+                    'failed': len([i for i in self.failed if i not in self.jobs]),
+                    'retries': self.retries, 'duplicates': self.duplicates}
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+        if self.records is not None:
+            self.records.close()
+
+def selfplay_jobs(first, second, games, batch=10, max_plies=300, seed=0):
+    """Jobs playing games between two MorrisAI option dicts, colours
+    alternating, seeded like tournament.run_tournament"""
+    check_engine(first)
+    check_engine(second)
+    options = {'first': first, 'second': second, 'max_plies': max_plies}
+    tag = settings_tag(options)
+    for start in range(0, games, batch):
+        items = [[seed * 1000003 + n, n % 2 == 1] for n in range(start, min(start + batch, games))]
+        yield {'id': f'selfplay-{tag}-{seed}-{start}', 'kind': 'selfplay',
+               'options': options, 'items': items}
+
+def analysis_jobs(path, batch=10, **options):
+    """Jobs analysing the games of a record file with MorrisAI(**options)"""
+    name = f'{os.path.basename(path)}-{settings_tag(options)}'
+    items = []
+    for n, record in enumerate(read_records(path)):
+        items.append(record.to_text())
+        if len(items) == batch:
+            yield {'id': f'analyse-{name}-{n + 1 - batch}', 'kind': 'analyse',
+                   'options': options, 'items': items}
+            items = []
+    if items:
+        yield {'id': f'analyse-{name}-{n + 1 - len(items)}', 'kind': 'analyse',
+               'options': options, 'items': items}
+
+def settings_tag(options):
+    """Short hash of job options, part of the job ids"""
+    return f'{zlib.crc32(json.dumps(options, sort_keys=True).encode()):08x}'
+
+def run_job(job):
+    """Worker: the result of one job"""
+    options = job['options']
+    if job['kind'] == 'selfplay':
+        records = []
+        for seed, swapped in job['items']:
+            _, _, _, record = play_match_game(((0, 1), options['first'], options['second'],
+                                               swapped, seed, options['max_plies']))
+            records.append(record.to_text())
+        return {'records': records}
+    if job['kind'] == 'analyse':
+        return {'analyses': [analyse_record((GameRecord.from_text(text), options))
+                             for text in job['items']]}
+    raise ValueError(f"unknown job kind {job['kind']!r}")
+
+def deliver(send, poll, patience):
+    """Call send until the coordinator answers, retrying on OSError
+    for patience seconds; False if it never does"""
+    deadline = time.monotonic() + patience
+    while True:
+        try:
+            send()
+            return True
+        except OSError:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(poll)
+
+def work(transport, worker=None, poll=1.0, patience=30.0):
+    """Run jobs from transport until the coordinator is finished, or
+    unreachable for patience seconds; returns the number of jobs run"""
+    if worker is None:
+        worker = f'{socket.gethostname()}-{os.getpid()}'
+    count = 0
+    lost = None
+    while True:
+        try:
+            job = transport.lease(worker)
+            if job is None and transport.finished():
+                return count
+            lost = None
+        except OSError:
+            if lost is None:
+                lost = time.monotonic()
+            elif time.monotonic() - lost > patience:
+                return count
+            job = None
+        if job is None:
+            time.sleep(poll)
+            continue
+
+        # Keep the lease alive while the job runs
+        done = threading.Event()
+
+        def keep_alive():
+            while not done.wait(job['lease_seconds'] / 3):
+                try:
+                    transport.renew(job)
+                except OSError:
+                    pass
+
+        keeper = threading.Thread(target=keep_alive, daemon=True)
+        keeper.start()
+        try:
+            result, error = run_job(job), None
+        except Exception as e:  # A bad job must not take the worker down
+            result, error = None, repr(e)
+        finally:
+            done.set()
+            keeper.join()
+        if error is not None:
+            if not deliver(lambda: transport.fail(job, error), poll, patience):
+                return count
+            continue
+        if not deliver(lambda: transport.complete(job, result, worker), poll, patience):
+            return count
+        count += 1
+
+def parse_address(address):
+    """'host:port' -> (host, port); anything else is a Unix socket path"""
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit() and '/' not in address:
+        return host, int(port)
+    return address
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        coordinator = self.server.coordinator
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                cmd = request['cmd']
+                if cmd == 'lease':
+                    reply = {'job': coordinator.lease(request['worker'])}
+                elif cmd == 'renew':
+                    reply = {'ok': coordinator.renew(request['job'])}
+                elif cmd == 'complete':
+                    reply = {'ok': coordinator.complete(request['job'], request['result'],
+                                                        request.get('worker'))}
+                elif cmd == 'fail':
+                    reply = {'ok': coordinator.fail(request['job'], request['error'])}
+                elif cmd == 'finished':
+                    reply = {'finished': coordinator.finished()}
+                else:
+                    raise ValueError(f'unknown command {cmd!r}')
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+def serve(coordinator, address):
+    """Serve coordinator at address from a background thread; returns
+    the server, to be stopped with shutdown()"""
+    address = parse_address(address)
+    if isinstance(address, tuple):
+        server = _TCPServer(address, _Handler)
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = _UnixServer(address, _Handler)
+    server.coordinator = coordinator
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class SocketClient:
+    """Worker side of serve(); one connection per request, so a
+    restarted coordinator is picked up again"""
+    def __init__(self, address, timeout=30.0):
+        self.address = parse_address(address)
+        self.timeout = timeout
+
+    def request(self, **request):
+        family = socket.AF_INET if isinstance(self.address, tuple) else socket.AF_UNIX
+        if family == socket.AF_INET:
+            connection = socket.create_connection(self.address, self.timeout)
+        else:
+            connection = socket.socket(family)
+            connection.settimeout(self.timeout)
+            connection.connect(self.address)
+        with connection, connection.makefile('rwb') as f:
+            f.write(json.dumps(request).encode() + b'\n')
+            f.flush()
+            line = f.readline()
+        if not line:
+            raise ConnectionError('coordinator closed the connection')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        return reply
+
+    def lease(self, worker):
+        return self.request(cmd='lease', worker=worker)['job']
+
+    def renew(self, job):
+        return self.request(cmd='renew', job=lease_of(job))['ok']
+
+    def complete(self, job, result, worker=None):
+        return self.request(cmd='complete', job=lease_of(job), result=result, worker=worker)['ok']
+
+    def fail(self, job, error):
+        return self.request(cmd='fail', job=lease_of(job), error=error)['ok']
+
+    def finished(self):
+        return self.request(cmd='finished')['finished']
+
+def lease_of(job):
+    """The part of a leased job the coordinator needs back"""
+    return {'id': job['id'], 'lease': job['lease']}
+
+class Spool:
+    """A directory shared by the coordinator and its workers.
+
+    Jobs wait in queue/ as one file each. A worker claims one by
+    renaming it into active/ (only one rename can succeed), touches it
+    to renew the lease and writes its result into results/. The
+    coordinator calls pump() to move results and leases between the
+    directories and its Coordinator.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.queue = os.path.join(path, 'queue')
+        self.active = os.path.join(path, 'active')
+        self.results = os.path.join(path, 'results')
+        for directory in (self.queue, self.active, self.results):
+            os.makedirs(directory, exist_ok=True)
+        self.marker = os.path.join(path, 'finished')
+
+    @staticmethod
+    def name(job):
+        return f"{job['id']}.{job['lease']}.json"
+
+    @staticmethod
+    def write(path, data):
+        """Write a file other processes only ever see complete"""
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+
+    # Worker side
+
+    def lease(self, worker):
+        for name in sorted(os.listdir(self.queue)):
+            if not name.endswith('.json'):
+                continue
+            claimed = os.path.join(self.active, name)
+            try:
+                os.rename(os.path.join(self.queue, name), claimed)
+            except FileNotFoundError:
+                continue  # Another worker was first
+            os.utime(claimed)  # The lease runs from the claim
+            with open(claimed) as f:
+                return json.load(f)
+        return None
+
+    def renew(self, job):
+        try:
+            os.utime(os.path.join(self.active, self.name(job)))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, job, result, worker=None):
+        self.finish(job, {'result': result, 'worker': worker})
+        return True
+
+    def fail(self, job, error):
+        self.finish(job, {'error': error})
+        return True
+
+    def finish(self, job, outcome):
+        self.write(os.path.join(self.results, self.name(job)), dict(outcome, job=lease_of(job)))
+        discard(os.path.join(self.active, self.name(job)))
+
+    def finished(self):
+        return os.path.exists(self.marker)
+
+    # Coordinator side
+
+    def pump(self, coordinator, prefetch=16):
+        """Collect results, renew the leases of waiting and live jobs,
+        drop claims whose worker has gone quiet, and queue up to
+        prefetch jobs; writes the finished marker once all is done"""
+        for name in os.listdir(self.results):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.results, name)
+            with open(path) as f:
+                outcome = json.load(f)
+            if 'error' in outcome:
+                coordinator.fail(outcome['job'], outcome['error'])
+            else:
+                coordinator.complete(outcome['job'], outcome['result'], outcome['worker'])
+            os.unlink(path)
+
+        now = time.time()
+        waiting = 0
+        for directory in (self.queue, self.active):
+            for name in os.listdir(directory):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(directory, name)
+                job_id, lease, _ = name.rsplit('.', 2)
+                try:
+                    age = now - os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue  # Claimed or finished meanwhile
+                if directory == self.active and age > coordinator.lease_seconds:
+                    # Its worker is gone; the lease expires and the job
+                    # is queued again under a new lease
+                    discard(path)
+                    continue
+                if not coordinator.renew({'id': job_id, 'lease': lease}):
+                    discard(path)  # Done or expired meanwhile
+                elif directory == self.queue:
+                    waiting += 1
+
+        while waiting < prefetch:
+            job = coordinator.lease('spool')
+            if job is None:
+                break
+            self.write(os.path.join(self.queue, self.name(job)), job)
+            waiting += 1
+
+        if coordinator.finished():
+            open(self.marker, 'w').close()
+            return True
+        discard(self.marker)
+        return False
+
+def discard(path):
+    """Remove a file another process may have moved or removed"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def coordinate(coordinator, address=None, spool=None, poll=1.0, linger=5.0, report=print):
+    """Serve coordinator until every job is done or given up. After the
+    last job the socket stays up for linger seconds so waiting workers
+    hear that the work is finished."""
+    last = None
+    if spool is not None:
+        spool = Spool(spool)
+        while not spool.pump(coordinator):
+            time.sleep(poll)
+            last = progress(coordinator, last, report)
+    else:
+        server = serve(coordinator, address)
+        try:
+            while not coordinator.finished():
+                time.sleep(poll)
+                last = progress(coordinator, last, report)
+            time.sleep(linger)
+        finally:
+            server.shutdown()
+            server.server_close()
+    progress(coordinator, None, report)
+
+def progress(coordinator, last, report):
+    """Report the coordinator's stats when they have changed"""
+    stats = coordinator.stats()
+    if report is not None and stats != last:
+        report(json.dumps(stats))
+    return stats
+
+def connect(address=None, spool=None):
+    return Spool(spool) if spool is not None else SocketClient(address)
+
+def run_worker(address, spool, poll):
+    """Process entry point of work --processes"""
+    return work(connect(address, spool), poll=poll)
+
+def main():
+    parser = argparse.ArgumentParser(description='Distribute self-play and analysis over machines')
+    transport = argparse.ArgumentParser(add_help=False)
+    where = transport.add_mutually_exclusive_group(required=True)
+    where.add_argument('--address', help="coordinator socket: 'host:port' or a Unix socket path")
+    where.add_argument('--spool', help='directory shared by the coordinator and its workers')
+    transport.add_argument('--poll', type=float, default=1.0, help='seconds between checks')
+    queue = argparse.ArgumentParser(add_help=False, parents=[transport])
+    queue.add_argument('--batch', type=int, default=10, help='games per job')
+    queue.add_argument('--journal', default='results.jsonl',
+                       help='finished jobs, also read to skip them on restart')
+    queue.add_argument('--lease', type=float, default=LEASE_SECONDS,
+                       help='seconds a job stays leased without a sign of life')
+    queue.add_argument('--attempts', type=int, default=MAX_ATTEMPTS)
+
+    sub = parser.add_subparsers(dest='command', required=True)
+    selfplay = sub.add_parser('selfplay', parents=[queue], help='coordinate engine-vs-engine games')
+    selfplay.add_argument('first', help="MorrisAI options, e.g. 'difficulty=5,time_limit=0.1'")
+    selfplay.add_argument('second')
+    selfplay.add_argument('--games', type=int, default=100)
+    selfplay.add_argument('--max-plies', type=int, default=300)
+    selfplay.add_argument('--seed', type=int, default=0)
+    selfplay.add_argument('--record', help='append the games to this record file (.bin: binary)')
+    analyse = sub.add_parser('analyse', parents=[queue], help='coordinate analysis of a record file')
+    analyse.add_argument('path')
+    analyse.add_argument('--difficulty', type=int, default=5)
+    analyse.add_argument('--time-limit', type=float, default=0.1)
+    analyse.add_argument('--lines', type=int, default=0, help='moves to rank per position')
+    worker = sub.add_parser('work', parents=[transport], help='run jobs for a coordinator')
+    worker.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        if args.processes == 1:
+            print(f'{run_worker(args.address, args.spool, args.poll)} jobs')
+        else:
+            with multiprocessing.Pool(args.processes) as pool:
+                counts = pool.starmap(run_worker, [(args.address, args.spool, args.poll)]
+                                      * args.processes)
+            print(f'{sum(counts)} jobs')
+        return
+
+    coordinator = Coordinator(args.lease, args.attempts, args.journal,
+                              getattr(args, 'record', None))
+    if args.command == 'selfplay':
+        jobs = selfplay_jobs(parse_engine(args.first), parse_engine(args.second), args.games,
+                             args.batch, args.max_plies, args.seed)
+    else:
+        jobs = analysis_jobs(args.path, args.batch, difficulty=args.difficulty,
+                             time_limit=args.time_limit, tt_size_mb=4, lines=args.lines)
+    for job in jobs:
+        coordinator.submit(job)
+    try:
+        coordinate(coordinator, args.address, args.spool, args.poll)
+    finally:
+        coordinator.close()
+
+if __name__ == '__main__':
+    main()